@@ -1,158 +1,2783 @@
-from flask import Flask, render_template, send_from_directory, request, jsonify, redirect, url_for, session
+from flask import Flask, render_template, send_from_directory, send_file, request, jsonify, redirect, url_for, session, g, has_app_context, has_request_context, stream_with_context
+import click
 import sqlite3
+import threading
+from contextlib import contextmanager
 import os
+import json
+import base64
+import time
+import random
+import re
+import mimetypes
+import struct
+import secrets
+import csv
+import io
+import gzip
+import hashlib
+import queue
+import atexit
+import cProfile
+import pstats
+import tempfile
+from collections import OrderedDict
+from urllib.parse import urlencode
 from pathlib import Path
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
+from werkzeug.http import parse_content_range_header
+from werkzeug.wsgi import get_input_stream
+from werkzeug.datastructures import CallbackDict
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flask.sessions import SessionInterface, SessionMixin
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, TimeoutError as FutureTimeout
+from PIL import Image
 
-app = Flask(__name__)
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+except ImportError:
+    PasswordHasher = None
+
+app = Flask(__name__, static_folder=None)
 app.secret_key = 'your-secret-key-here'
 
-# 配置文件
-app.config.update({
-    'UPLOAD_FOLDER': 'static/uploads',
-    'ALLOWED_EXTENSIONS': {'png', 'jpg', 'jpeg', 'mp3', 'wav'},
-    'MAX_CONTENT_LENGTH': 16 * 1024 * 1024,
-    'DATABASE': 'music.db',
-    'DEFAULT_ADMIN': {'username': 'admin', 'password': 'admin123', 'email': 'admin@example.com'}
-})
+# 配置文件
+app.config.update({
+    'UPLOAD_FOLDER': 'static/uploads',
+    'ALLOWED_EXTENSIONS': {'png', 'jpg', 'jpeg', 'mp3', 'wav'},
+    'MAX_CONTENT_LENGTH': 16 * 1024 * 1024,
+    'DATABASE': 'music.db',
+    # 存储后端：sqlite（DATABASE 为文件路径）或 postgresql（DATABASE 为连接串，需要安装 psycopg）
+    'DB_BACKEND': 'sqlite',
+    # 连接池：每个请求复用同一连接，空闲连接最多保留 DB_POOL_SIZE 个（0 表示不复用）
+    'DB_POOL_SIZE': 8,
+    # 为 True 时事务外的每条语句单独取用连接（配合 DB_POOL_SIZE=0 即原先每次查询新建连接的行为，用于基准对比）
+    'DB_CONNECTION_PER_QUERY': False,
+    'DB_PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000
+    },
+    # 只读副本：自动提交的 SELECT 随机路由到 DB_REPLICAS 中的文件，写入及事务始终走主库。
+    # 副本由单独的同步进程每 REPLICA_SYNC_INTERVAL 秒从主库整体复制一次：gunicorn 主进程、开发服务器，
+    # 或 flask sync-replicas --interval（None 表示只由外部定时执行 flask sync-replicas 刷新）。会话写入后 READ_YOUR_WRITES_TTL 秒内的读取仍走主库，应不小于同步间隔
+    'DB_REPLICAS': [],
+    'REPLICA_SYNC_INTERVAL': 5,
+    'READ_YOUR_WRITES_TTL': 10,
+    # 同步进程在曲库有变化的同步之后更新 catalog_version.synced_version；
+    # 各进程每 REPLICA_VERSION_POLL_INTERVAL 秒检查一次，变化时清空自己的响应缓存
+    'REPLICA_VERSION_POLL_INTERVAL': 1,
+    'DEFAULT_ADMIN': {'username': 'admin', 'password': 'admin123', 'email': 'admin@example.com'},
+    # 密码哈希：werkzeug 的 'scrypt:n:r:p' / 'pbkdf2:sha256:迭代次数'，或 'argon2:time_cost:memory_kib:parallelism'
+    # （需要安装 argon2-cffi）。修改参数后，旧哈希会在用户下次登录时自动重新计算
+    'PASSWORD_HASH_METHOD': 'scrypt:16384:8:1',
+    # 登录限流：令牌桶容量及每秒补充的令牌数，只有验证失败的尝试消耗令牌，
+    # 分别按 (用户名, IP) 和 IP 计数；客户端 IP 经 TRUSTED_PROXIES 还原
+    'LOGIN_RATE_LIMIT_CAPACITY': 10,
+    'LOGIN_RATE_LIMIT_REFILL': 10 / 60,
+    'RATE_LIMIT_MAX_KEYS': 100000,
+    # 服务端会话：sqlite 存在 sessions 表，redis 使用 CACHE_REDIS_URL。
+    # 会话和用户记录在进程内缓存；改角色、删除用户、退出登录会写入 auth_revocations 表，
+    # 各进程每 AUTH_REVOCATION_POLL_INTERVAL 秒最多查询一次新记录并移除对应缓存，不必等待 TTL
+    'SESSION_BACKEND': 'sqlite',
+    'AUTH_REVOCATION_POLL_INTERVAL': 1,
+    'SESSION_CACHE_TTL': 30,
+    'SESSION_CACHE_MAX_ENTRIES': 10000,
+    'USER_CACHE_TTL': 60,
+    'USER_CACHE_MAX_ENTRIES': 10000,
+    'SONGS_PAGE_SIZE': 50,
+    'SONGS_MAX_PAGE_SIZE': 200,
+    'COMMENTS_PAGE_SIZE': 20,
+    'COMMENTS_MAX_PAGE_SIZE': 100,
+    'SEARCH_PAGE_SIZE': 20,
+    'SEARCH_MAX_PAGE_SIZE': 100,
+    # 收藏排行榜：按天汇总的收藏数，结果缓存 CHARTS_CACHE_TTL 秒
+    'CHARTS_SIZE': 50,
+    'CHARTS_CACHE_TTL': 60,
+    'FAVORITES_BATCH_MAX': 200,
+    'CATEGORY_BATCH_MAX': 1000,
+    # 媒体文件：由前端服务器发送文件时设置 USE_X_SENDFILE（Apache/lighttpd）
+    # 或 MEDIA_ACCEL_REDIRECT_PREFIX（nginx internal location，例如 '/protected-static/'）
+    'USE_X_SENDFILE': False,
+    'MEDIA_ACCEL_REDIRECT_PREFIX': None,
+    # 以内容哈希命名的文件（上传的音频、封面衍生图）长期缓存并标记 immutable；
+    # 其他媒体文件可能被原地替换，缓存 MEDIA_REVALIDATE_MAX_AGE 秒后用 ETag 重新验证
+    'MEDIA_MAX_AGE': 365 * 24 * 3600,
+    'MEDIA_REVALIDATE_MAX_AGE': 3600,
+    # 封面衍生图：按宽度生成多种尺寸和格式，文件名带内容哈希，由后台线程生成
+    'COVER_SIZES': (160, 320, 640),
+    'COVER_FORMATS': ('avif', 'webp', 'jpeg'),
+    'COVER_QUALITY': 80,
+    'COVER_VARIANTS_DIR': 'covers/variants',
+    # 后台任务线程数（封面衍生图、音频元数据）
+    'BACKGROUND_WORKERS': 2,
+    # 分片上传：单个分片受 MAX_CONTENT_LENGTH 限制，整个文件受 UPLOAD_MAX_FILE_SIZE 限制
+    'UPLOAD_CHUNK_SIZE': 8 * 1024 * 1024,
+    'UPLOAD_MAX_FILE_SIZE': 2 * 1024 * 1024 * 1024,
+    # 批量导入：请求体按行流式读取，不受 MAX_CONTENT_LENGTH 限制
+    'BULK_IMPORT_MAX_SIZE': 1024 * 1024 * 1024,
+    'BULK_BATCH_SIZE': 1000,
+    # 歌曲接口响应缓存：memory 为进程内 LRU，redis 需要安装 redis 包
+    'CACHE_BACKEND': 'memory',
+    'CACHE_MAX_ENTRIES': 1024,
+    'CACHE_TTL': 300,
+    'CACHE_REDIS_URL': 'redis://localhost:6379/0',
+    # 每个用户的收藏版本号（拼入 ETag）单独存放，不占用响应缓存的容量和命中统计；
+    # 与 CACHE_BACKEND 使用同一种存储，过期后只会让该用户的下一次请求重新下载
+    'FAVORITES_VERSION_MAX_ENTRIES': 10000,
+    'FAVORITES_VERSION_TTL': 24 * 3600,
+    # JSON 响应超过该字节数且客户端支持时压缩（brotli 优先，需要安装 brotli 包）
+    'COMPRESS_MIN_SIZE': 1024,
+    'COMPRESS_LEVEL': 6,
+    # 相关歌曲：每首歌预先保存的候选数量、详情页展示数量，以及共同收藏/共同分类的权重
+    'RELATED_SONGS_STORED': 20,
+    'RELATED_SONGS_SHOWN': 3,
+    'RELATED_WEIGHT_FAVORITE': 1.0,
+    'RELATED_WEIGHT_CATEGORY': 2.0,
+    # 监控指标：/metrics 输出 Prometheus 文本格式，需要管理员登录，或携带 Authorization: Bearer <METRICS_TOKEN>
+    'METRICS_ENABLED': True,
+    'METRICS_TOKEN': None,
+    'METRICS_MAX_QUERIES': 500,
+    # 超过该毫秒数的 SQL 记录到日志，None 表示关闭
+    'SLOW_QUERY_MS': 200,
+    # 开启后，带 X-Profile 请求头的单个请求返回性能分析结果（有 pyinstrument 时使用采样分析）
+    'PROFILE_REQUESTS': False,
+    # 写入队列：开启后收藏和评论交给单个写线程，每 WRITE_BEHIND_INTERVAL 秒合并为一个事务提交。
+    # WRITE_BEHIND_DURABILITY 为 commit 时请求等待所在事务提交后返回；为 queued 时入队即返回，
+    # 进程崩溃会丢失尚未提交的写入。commit 模式等待超过 WRITE_BEHIND_COMMIT_TIMEOUT 秒时同样按已入队返回。
+    # 队列满时等待 WRITE_BEHIND_PUT_TIMEOUT 秒，仍满则返回 503
+    'WRITE_BEHIND': False,
+    'WRITE_BEHIND_DURABILITY': 'commit',
+    'WRITE_BEHIND_QUEUE_SIZE': 10000,
+    'WRITE_BEHIND_BATCH_SIZE': 500,
+    'WRITE_BEHIND_INTERVAL': 0.005,
+    'WRITE_BEHIND_PUT_TIMEOUT': 0.05,
+    'WRITE_BEHIND_COMMIT_TIMEOUT': 5,
+    # 应用前的反向代理层数（如 nginx 为 1）。大于 0 时按 X-Forwarded-For/-Proto 还原客户端地址和协议；
+    # 在导入时生效。未经代理直接对外时必须为 0，否则客户端可以伪造 IP
+    'TRUSTED_PROXIES': 0
+})
+
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                            x_proto=app.config['TRUSTED_PROXIES'])
+
+# 歌曲列表支持的排序：参数值 -> (列名, 是否降序)
+SONG_SORTS = {
+    '-created_at': ('created_at', True),
+    'duration': ('duration_seconds', False),
+    '-duration': ('duration_seconds', True)
+}
+
+# music 表中允许通过 fields 参数投影的列；列表默认不返回歌词
+SONG_FIELDS = ('id', 'title', 'artist', 'album', 'duration', 'duration_seconds', 'bitrate',
+               'sample_rate', 'cover_path', 'cover_variants', 'audio_path', 'genre',
+               'release_date', 'lyrics', 'categories', 'tags', 'created_at')
+SONG_LIST_FIELDS = tuple(f for f in SONG_FIELDS if f != 'lyrics')
+# 新增和修改歌曲时必须提供的字段
+SONG_REQUIRED_FIELDS = ('title', 'artist', 'album', 'duration', 'cover_path',
+                        'audio_path', 'genre', 'release_date', 'lyrics')
+
+# 存储后端：封装连接、方言和事务控制。SQL 统一使用 ? 占位符，查询结果行支持 row['列名']、row[序号] 和 dict(row)
+DatabaseError = (sqlite3.Error,) + ((psycopg.Error,) if psycopg is not None else ())
+IntegrityError = (sqlite3.IntegrityError,) + ((psycopg.IntegrityError,) if psycopg is not None else ())
+
+class SQLiteBackend:
+    name = 'sqlite'
+    full_text_search = True
+
+    def connect(self, database, pragmas, readonly=False):
+        if readonly:
+            # 只读副本：journal_mode 随备份从主库复制而来，只读连接不能修改
+            conn = sqlite3.connect(Path(database).absolute().as_uri() + '?mode=ro', uri=True,
+                                   check_same_thread=False)
+        else:
+            conn = sqlite3.connect(database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in pragmas.items():
+            if not (readonly and name == 'journal_mode'):
+                conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def prepare(self, query):
+        return query
+
+    def begin(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+
+    def commit(self, conn):
+        conn.commit()
+
+    def rollback(self, conn):
+        conn.rollback()
+
+    def in_transaction(self, conn):
+        return conn.in_transaction
+
+    def schema_version(self):
+        return DB.execute("SELECT user_version FROM pragma_user_version", primary=True)[0]['user_version']
+
+    def set_schema_version(self, version):
+        DB.execute(f"PRAGMA user_version = {int(version)}")
+
+class Row(tuple):
+    # 与 sqlite3.Row 接口一致的结果行，供非 SQLite 后端使用
+    def __new__(cls, names, values):
+        row = super().__new__(cls, values)
+        row._names = names
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return super().__getitem__(self._names[key])
+        return super().__getitem__(key)
+
+    def keys(self):
+        return list(self._names)
+
+class PostgresBackend:
+    name = 'postgresql'
+    full_text_search = False
+
+    def __init__(self):
+        if psycopg is None:
+            raise RuntimeError('DB_BACKEND 为 postgresql 时需要安装 psycopg 包')
+
+    @staticmethod
+    def _row_factory(cursor):
+        names = {column.name: i for i, column in enumerate(cursor.description or ())}
+        return lambda values: Row(names, values)
+
+    def connect(self, database, pragmas, readonly=False):
+        # 使用自动提交，事务由 begin/commit 显式控制；SQLite 的 PRAGMA 不适用
+        conn = psycopg.connect(database, autocommit=True, row_factory=self._row_factory)
+        conn.read_only = readonly
+        return conn
+
+    def prepare(self, query):
+        return query.replace('%', '%%').replace('?', '%s')
+
+    def begin(self, conn):
+        conn.execute('BEGIN')
+
+    def commit(self, conn):
+        if self.in_transaction(conn):
+            conn.execute('COMMIT')
+
+    def rollback(self, conn):
+        if self.in_transaction(conn):
+            conn.execute('ROLLBACK')
+
+    def in_transaction(self, conn):
+        return conn.info.transaction_status != psycopg.pq.TransactionStatus.IDLE
+
+    def schema_version(self):
+        DB.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        rows = DB.execute("SELECT version FROM schema_version", primary=True)
+        return rows[0]['version'] if rows else 0
+
+    def set_schema_version(self, version):
+        DB.execute("DELETE FROM schema_version")
+        DB.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+
+BACKENDS = {'sqlite': SQLiteBackend, 'postgresql': PostgresBackend}
+_backends = {}
+
+def get_backend():
+    name = app.config['DB_BACKEND']
+    if name not in _backends:
+        if name not in BACKENDS:
+            raise RuntimeError(f'未知的 DB_BACKEND: {name}')
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+# 数据库连接池
+class ConnectionPool:
+    def __init__(self, database, size, pragmas, readonly=False, backend=None):
+        self.database = database
+        self.size = size
+        self.pragmas = pragmas
+        self.readonly = readonly
+        self.backend = backend or get_backend()
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _connect(self):
+        with self._lock:
+            self.opened += 1
+        return self.backend.connect(self.database, self.pragmas, self.readonly)
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, conn):
+        self.backend.rollback(conn)
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self.opened -= 1
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.opened -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {'open': self.opened, 'idle': len(self._idle)}
+
+# 数据库辅助函数
+SQL_RETURNING = re.compile(r'\bRETURNING\b', re.IGNORECASE)
+
+class DB:
+    _pools = {}
+    _ready_replicas = set()
+    _pools_lock = threading.Lock()
+    _local = threading.local()
+
+    @staticmethod
+    def pool(database=None):
+        database = database or app.config['DATABASE']
+        with DB._pools_lock:
+            pool = DB._pools.get(database)
+            if pool is None:
+                pool = ConnectionPool(database, app.config['DB_POOL_SIZE'], app.config['DB_PRAGMAS'],
+                                      readonly=database != app.config['DATABASE'])
+                DB._pools[database] = pool
+            return pool
+
+    @staticmethod
+    def read_database():
+        # 只读查询路由到副本；本请求已写入，或会话在 READ_YOUR_WRITES_TTL 内写入过时仍读主库
+        replicas = app.config['DB_REPLICAS']
+        if not replicas or (has_app_context() and g.get('_db_wrote')):
+            return None
+        if has_request_context() and session.get('db_primary_until', 0) > time.time():
+            return None
+        if get_backend().name == 'sqlite':
+            # 同步进程第一次复制之前副本文件还不存在，此前读主库
+            replicas = [replica for replica in replicas if DB.replica_ready(replica)]
+            if not replicas:
+                return None
+        return random.choice(replicas)
+
+    @staticmethod
+    def replica_ready(replica):
+        if replica not in DB._ready_replicas and os.path.exists(replica):
+            DB._ready_replicas.add(replica)
+        return replica in DB._ready_replicas
+
+    @staticmethod
+    def get_connection(read=False):
+        # 事务进行中时，所有语句都走事务所持有的连接
+        tx_conn = getattr(DB._local, 'tx_conn', None)
+        if tx_conn is not None:
+            return tx_conn
+        database = DB.read_database() if read else None
+        # 在应用上下文中，同一请求内的查询共享一个主库连接和一个副本连接，请求结束时归还连接池
+        if has_app_context():
+            conn_key, pool_key = ('_db_read_conn', '_db_read_pool') if database else ('_db_conn', '_db_pool')
+            if conn_key not in g:
+                setattr(g, pool_key, DB.pool(database))
+                setattr(g, conn_key, g.get(pool_key).acquire())
+            return g.get(conn_key)
+        return DB.pool(database).acquire()
+
+    @staticmethod
+    @contextmanager
+    def connection(read=False):
+        tx_conn = getattr(DB._local, 'tx_conn', None)
+        if tx_conn is not None or (has_app_context() and not app.config['DB_CONNECTION_PER_QUERY']):
+            yield DB.get_connection(read)
+            return
+        pool = DB.pool(DB.read_database() if read else None)
+        conn = pool.acquire()
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+
+    @staticmethod
+    def in_transaction():
+        return getattr(DB._local, 'tx_depth', 0) > 0
+
+    @staticmethod
+    @contextmanager
+    def transaction():
+        # 工作单元：块内的 execute/executemany 共用一个连接，结束时统一提交一次，出错则整体回滚
+        if DB.in_transaction():
+            DB._local.tx_depth += 1
+            try:
+                yield
+            finally:
+                DB._local.tx_depth -= 1
+            return
+
+        DB._mark_write()
+        backend = get_backend()
+        with DB.connection() as conn:
+            backend.rollback(conn)
+            DB._local.tx_conn = conn
+            DB._local.tx_depth = 1
+            try:
+                backend.begin(conn)
+                yield
+                backend.commit(conn)
+            except BaseException:
+                backend.rollback(conn)
+                raise
+            finally:
+                DB._local.tx_conn = None
+                DB._local.tx_depth = 0
+
+    @staticmethod
+    def _run(statement, commit, query, read=False):
+        with DB.connection(read) as conn:
+            # 事务内的语句由 transaction() 统一提交或回滚
+            if DB.in_transaction():
+                return DB._timed(statement, conn.cursor(), query)
+            backend = get_backend()
+            try:
+                result = DB._timed(statement, conn.cursor(), query)
+                if commit:
+                    backend.commit(conn)
+                return result
+            except DatabaseError as e:
+                backend.rollback(conn)
+                raise e
+            finally:
+                # 与原先关闭连接的行为一致：未提交的修改不会遗留在复用的连接上
+                if not commit:
+                    backend.rollback(conn)
+
+    @staticmethod
+    def _timed(statement, cursor, query):
+        if not app.config['METRICS_ENABLED'] and app.config['SLOW_QUERY_MS'] is None:
+            return statement(cursor)
+        start = time.perf_counter()
+        try:
+            return statement(cursor)
+        finally:
+            observe_query(query, time.perf_counter() - start)
+
+    @staticmethod
+    def execute(query, params=(), commit=False, primary=False):
+        # SELECT 返回所有行；带 RETURNING 的写入返回第一行第一列（没有行时为 None）；
+        # 其他 INSERT 在 SQLite 上返回 lastrowid，需要新 id 时应使用 RETURNING id 以兼容各后端
+        prepared = get_backend().prepare(query)
+        keyword = query.lstrip()[:6].upper()
+        returning = SQL_RETURNING.search(query) is not None
+
+        def statement(cursor):
+            cursor.execute(prepared, params)
+            if keyword == 'SELECT':
+                return cursor.fetchall()
+            if returning:
+                rows = cursor.fetchall()
+                return rows[0][0] if rows else None
+            if keyword == 'INSERT':
+                return getattr(cursor, 'lastrowid', None)
+            return True
+        # 自动提交模式下的 SELECT 可以由只读副本执行；primary=True 用于必须读到最新数据的查询（会话、登录）
+        is_select = keyword == 'SELECT'
+        if commit or not is_select:
+            DB._mark_write()
+        return DB._run(statement, commit, query, read=is_select and not commit and not primary)
+
+    @staticmethod
+    def executemany(query, seq_of_params, commit=False):
+        prepared = get_backend().prepare(query)
+
+        def statement(cursor):
+            cursor.executemany(prepared, seq_of_params)
+            return cursor.rowcount
+        DB._mark_write()
+        return DB._run(statement, commit, query)
+
+    @staticmethod
+    def _mark_write():
+        # g._db_wrote 使本请求之后的读取走主库
+        if has_app_context():
+            g._db_wrote = True
+
+    @staticmethod
+    def close_pools():
+        with DB._pools_lock:
+            pools, DB._pools = DB._pools, {}
+        for pool in pools.values():
+            pool.close_all()
+
+@app.teardown_appcontext
+def release_connection(exception=None):
+    for conn_key, pool_key in (('_db_conn', '_db_pool'), ('_db_read_conn', '_db_read_pool')):
+        conn = g.pop(conn_key, None)
+        if conn is not None:
+            g.pop(pool_key).release(conn)
+
+# 读写分离：请求中发生写入后，在会话中记录一段时间内继续读主库，保证读到自己的写入
+@app.after_request
+def stick_to_primary(response):
+    if app.config['DB_REPLICAS'] and g.get('_db_wrote') and 'user_id' in session:
+        session['db_primary_until'] = time.time() + app.config['READ_YOUR_WRITES_TTL']
+    return response
+
+# 只读副本：定期用 SQLite 在线备份 API 把主库完整复制到各副本文件
+def sync_replicas():
+    for replica in app.config['DB_REPLICAS']:
+        source = sqlite3.connect(app.config['DATABASE'])
+        target = sqlite3.connect(replica, timeout=app.config['DB_PRAGMAS'].get('busy_timeout', 5000) / 1000)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+class ReplicaSync:
+    # 每个部署只运行一个：副本文件是共享的，由 start_replica_sync() 或 flask sync-replicas --interval 启动。
+    # 可能运行在 gunicorn 主进程中，只使用独立的 sqlite3 连接，不使用连接池和缓存
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_sync = None
+        self.catalog_version = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.lock = None
+
+    def start(self):
+        self.sync()
+        self._thread = threading.Thread(target=self._run, name='replica-sync', daemon=True)
+        self._thread.start()
+        return self
+
+    def sync(self):
+        # 曲库写入会递增 catalog_version.version；会话、评论、收藏不会。只有曲库在上次同步后变化时，
+        # 期间从旧副本读出并缓存的结果才可能过期：副本追上主库后发布 synced_version，由各进程清空缓存
+        source = sqlite3.connect(app.config['DATABASE'],
+                                 timeout=app.config['DB_PRAGMAS'].get('busy_timeout', 5000) / 1000)
+        try:
+            version = source.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()[0]
+            sync_replicas()
+            self.last_sync = time.time()
+            if version != self.catalog_version:
+                with source:
+                    source.execute("UPDATE catalog_version SET synced_version = ? WHERE id = 1", (version,))
+                self.catalog_version = version
+        finally:
+            source.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except sqlite3.Error as e:
+                app.logger.error('同步只读副本失败: %s', e)
+
+    def stop(self):
+        self._stop.set()
+
+def bump_catalog_version():
+    # 只有配置了 SQLite 副本时才需要记录，由 invalidate_song_cache 在曲库写入提交后调用
+    if app.config['DB_REPLICAS'] and get_backend().name == 'sqlite':
+        DB.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1", commit=True)
+
+_replica_version_seen = None
+_replica_version_checked_at = 0
+_replica_version_lock = threading.Lock()
+
+@app.before_request
+def apply_replica_sync():
+    # 同步进程可能在其他进程中：按 synced_version 判断副本是否已包含新的曲库写入，
+    # 是则清空本进程（或共享的 redis）缓存，不再返回从旧副本读出的结果
+    global _replica_version_seen, _replica_version_checked_at
+    if not app.config['DB_REPLICAS'] or get_backend().name != 'sqlite':
+        return
+    now = time.monotonic()
+    with _replica_version_lock:
+        if now - _replica_version_checked_at < app.config['REPLICA_VERSION_POLL_INTERVAL']:
+            return
+        _replica_version_checked_at = now
+    synced = DB.execute("SELECT synced_version FROM catalog_version WHERE id = 1", primary=True)[0]['synced_version']
+    with _replica_version_lock:
+        changed = _replica_version_seen is not None and synced != _replica_version_seen
+        _replica_version_seen = synced
+    if changed:
+        cache = get_cache()
+        cache.clear()
+        cache.bump_version()
+
+# 同一台机器上多个服务进程之间的互斥（如 uvicorn 的多个 worker），按 DATABASE 区分锁文件。
+# 返回持有锁的文件对象，关闭即释放；非阻塞且锁已被占用时返回 None。没有 fcntl 的平台不加锁
+def process_lock(name, blocking=True):
+    digest = hashlib.sha1(app.config['DATABASE'].encode()).hexdigest()[:16]
+    lock_file = open(os.path.join(tempfile.gettempdir(), f'music-{digest}-{name}.lock'), 'w')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            lock_file.close()
+            return None
+    return lock_file
+
+def start_replica_sync():
+    # 在服务进程启动时调用（gunicorn 主进程的 when_ready、uvicorn 的 serve()、开发服务器），不在请求中同步。
+    # 多个进程都调用时只有取得锁的一个进程同步，锁随进程持有到退出。
+    # REPLICA_SYNC_INTERVAL 为 None 时由外部（例如定时执行 flask sync-replicas）负责刷新副本
+    if not app.config['DB_REPLICAS'] or app.config['REPLICA_SYNC_INTERVAL'] is None:
+        return None
+    if get_backend().name != 'sqlite':
+        return None
+    lock = process_lock('replica-sync', blocking=False)
+    if lock is None:
+        return None
+    syncer = ReplicaSync(app.config['REPLICA_SYNC_INTERVAL'])
+    syncer.lock = lock
+    return syncer.start()
+
+@app.cli.command('sync-replicas')
+@click.option('--interval', type=float, help='持续运行，每隔若干秒同步一次（作为独立的同步进程）')
+def sync_replicas_command(interval):
+    """把主库复制到 DB_REPLICAS 中的所有只读副本"""
+    if get_backend().name != 'sqlite':
+        # PostgreSQL 副本由流复制维护
+        print('副本同步仅支持 SQLite')
+        raise SystemExit(1)
+    syncer = ReplicaSync(interval)
+    if interval:
+        syncer.lock = process_lock('replica-sync', blocking=False)
+        if syncer.lock is None:
+            print('已有其他进程在同步副本')
+            raise SystemExit(1)
+    syncer.sync()
+    print(f"已同步 {len(app.config['DB_REPLICAS'])} 个副本")
+    if interval:
+        try:
+            syncer._run()
+        except KeyboardInterrupt:
+            pass
+
+# 监控指标：按路由统计请求耗时，按归一化后的 SQL 统计查询耗时，直方图桶为累计计数
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SQL_WHITESPACE = re.compile(r'\s+')
+SQL_IN_LIST = re.compile(r'IN \((?:\?\s*,\s*)*\?\)', re.IGNORECASE)
+
+def normalize_sql(query):
+    # 合并空白，并把变长的 IN (?, ?, ...) 归为一类，避免指标基数随参数个数增长
+    return SQL_IN_LIST.sub('IN (...)', SQL_WHITESPACE.sub(' ', query).strip())
+
+class Metrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.requests = {}
+        self.request_latency = {}
+        self.query_latency = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, series, key, seconds):
+        entry = series.get(key)
+        if entry is None:
+            entry = series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                entry['buckets'][i] += 1
+        entry['sum'] += seconds
+        entry['count'] += 1
+
+    def observe_request(self, method, route, status, seconds):
+        with self._lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._observe(self.request_latency, (method, route), seconds)
+
+    def observe_query(self, statement, seconds, max_statements):
+        with self._lock:
+            if statement not in self.query_latency and len(self.query_latency) >= max_statements:
+                statement = 'other'
+            self._observe(self.query_latency, (statement,), seconds)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.request_latency.clear()
+            self.query_latency.clear()
+
+    def render(self):
+        def labels(names, values):
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+            return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+        def histogram(name, names, series):
+            lines.append(f'# TYPE {name} histogram')
+            for key, entry in series.items():
+                label = labels(names, key)
+                for bound, count in zip(self.buckets, entry['buckets']):
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {entry["count"]}')
+                lines.append(f'{name}_sum{{{label}}} {entry["sum"]:.6f}')
+                lines.append(f'{name}_count{{{label}}} {entry["count"]}')
+
+        lines = []
+        with self._lock:
+            lines.append('# TYPE http_requests_total counter')
+            for key, count in self.requests.items():
+                lines.append(f"http_requests_total{{{labels(('method', 'route', 'status'), key)}}} {count}")
+            histogram('http_request_duration_seconds', ('method', 'route'), self.request_latency)
+            histogram('db_query_duration_seconds', ('statement',), self.query_latency)
+
+        # 连接池按 primary / replica0、replica1 ... 标识，不输出数据库文件路径或连接串
+        lines.append('# TYPE db_connections gauge')
+        with DB._pools_lock:
+            pools = list(DB._pools.values())
+        replicas = app.config['DB_REPLICAS']
+        for pool in pools:
+            if pool.database == app.config['DATABASE']:
+                name = 'primary'
+            elif pool.database in replicas:
+                name = f'replica{replicas.index(pool.database)}'
+            else:
+                name = 'other'
+            stats = pool.stats()
+            for state, value in (('idle', stats['idle']), ('in_use', stats['open'] - stats['idle'])):
+                lines.append(f"db_connections{{{labels(('pool', 'state'), (name, state))}}} {value}")
+        if _cache is not None:
+            # 本进程响应缓存的命中计数；redis 缓存时各进程分别统计，由 Prometheus 汇总
+            stats = _cache.stats()
+            lines.append('# TYPE cache_hits_total counter')
+            lines.append(f"cache_hits_total {stats['hits']}")
+            lines.append('# TYPE cache_misses_total counter')
+            lines.append(f"cache_misses_total {stats['misses']}")
+            if 'evictions' in stats:
+                lines.append('# TYPE cache_evictions_total counter')
+                lines.append(f"cache_evictions_total {stats['evictions']}")
+                lines.append('# TYPE cache_entries gauge')
+                lines.append(f"cache_entries {stats['entries']}")
+        if _write_queue is not None:
+            lines.append('# TYPE write_behind_queue_depth gauge')
+            lines.append(f'write_behind_queue_depth {_write_queue.depth()}')
+            lines.append('# TYPE write_behind_batches_total counter')
+            lines.append(f'write_behind_batches_total {_write_queue.batches}')
+            lines.append('# TYPE write_behind_writes_total counter')
+            lines.append(f'write_behind_writes_total {_write_queue.writes}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(LATENCY_BUCKETS)
+
+def observe_query(query, seconds):
+    statement = normalize_sql(query)
+    if app.config['METRICS_ENABLED']:
+        metrics.observe_query(statement, seconds, app.config['METRICS_MAX_QUERIES'])
+    threshold = app.config['SLOW_QUERY_MS']
+    if threshold is not None and seconds * 1000 >= threshold:
+        app.logger.warning('慢查询 %.1f ms: %s', seconds * 1000, statement)
+
+@app.before_request
+def start_request_timer():
+    g._request_start = time.perf_counter()
+    if app.config['PROFILE_REQUESTS'] and request.headers.get('X-Profile'):
+        if Profiler is not None:
+            g._profiler = Profiler()
+            g._profiler.start()
+        else:
+            g._profiler = cProfile.Profile()
+            g._profiler.enable()
+
+@app.after_request
+def record_request(response):
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        # 用分析结果替换本次响应
+        if Profiler is not None:
+            profiler.stop()
+            output = profiler.output_text(unicode=True)
+        else:
+            profiler.disable()
+            buffer = io.StringIO()
+            pstats.Stats(profiler, stream=buffer).sort_stats('cumulative').print_stats(40)
+            output = buffer.getvalue()
+        response = app.response_class(output, mimetype='text/plain')
+    start = g.pop('_request_start', None)
+    if app.config['METRICS_ENABLED'] and start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(request.method, route, response.status_code, time.perf_counter() - start)
+    return response
+
+# 响应缓存
+class LRUCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 目录版本号：全局版本加按范围（列表、单首歌曲）的版本；
+        # 带上进程启动标识，避免不同进程的 ETag 误判为相同
+        self._epoch = uuid.uuid4().hex[:8]
+        self._version = 0
+        self._versions = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def version(self, scope):
+        with self._lock:
+            return f'{self._epoch}.{self._version}.{self._versions.get(scope, 0)}'
+
+    def bump_version(self, scope=None):
+        # 不指定范围时所有 ETag 一起失效
+        with self._lock:
+            if scope is None:
+                self._version += 1
+                self._versions.clear()
+            else:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def stats(self):
+        return {
+            'backend': 'memory',
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+class RedisCache:
+    def __init__(self, url, ttl, namespace='music:'):
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND 为 redis 时需要安装 redis 包')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raw = self.client.get(self.namespace + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.namespace + key, json.dumps(value), ex=ttl or self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.namespace + key)
+
+    def delete_prefix(self, prefix):
+        keys = list(self.client.scan_iter(match=f'{self.namespace}{prefix}*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        self.delete_prefix('')
+
+    def version(self, scope):
+        versions = self.client.mget(self.namespace + 'catalog_version', f'{self.namespace}version:{scope}')
+        return '.'.join((v or b'0').decode() for v in versions)
+
+    def bump_version(self, scope=None):
+        # 不指定范围时递增全局版本，所有 ETag 一起失效
+        self.client.incr(self.namespace + ('catalog_version' if scope is None else f'version:{scope}'))
+
+    def stats(self):
+        return {'backend': 'redis', 'hits': self.hits, 'misses': self.misses}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if app.config['CACHE_BACKEND'] == 'redis':
+                _cache = RedisCache(app.config['CACHE_REDIS_URL'], app.config['CACHE_TTL'])
+            else:
+                _cache = LRUCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_TTL'])
+        return _cache
+
+# 列表缓存键包含全部查询参数；详情缓存键为歌曲 id。
+# 所有列表共用版本范围 'songs'；详情的 ETag 由缓存的响应内容派生，不使用版本号
+SONGS_VERSION_SCOPE = 'songs'
+
+def songs_cache_key():
+    return 'songs:' + urlencode(sorted(request.args.items(multi=True)))
+
+def song_cache_key(song_id):
+    return f'song:{song_id}'
+
+def invalidate_song_cache(song_id=None, listing=True):
+    # song_id：该歌曲的详情（含评论数、收藏数）变化；listing：列表中出现的字段或歌曲集合变化。
+    # 评论和收藏只影响详情，传 listing=False，不会使列表的 ETag 失效
+    cache = get_cache()
+    if song_id is not None:
+        cache.delete(song_cache_key(song_id))
+    if listing:
+        cache.delete_prefix('songs:')
+        cache.bump_version(SONGS_VERSION_SCOPE)
+        bump_catalog_version()
+
+# 密码哈希
+def _argon2_hasher(method):
+    if PasswordHasher is None:
+        raise RuntimeError('使用 argon2 需要安装 argon2-cffi 包')
+    _, time_cost, memory_cost, parallelism = method.split(':')
+    return PasswordHasher(time_cost=int(time_cost), memory_cost=int(memory_cost),
+                          parallelism=int(parallelism))
+
+def hash_password(password, method=None):
+    method = method or app.config['PASSWORD_HASH_METHOD']
+    if method.startswith('argon2'):
+        return _argon2_hasher(method).hash(password)
+    return generate_password_hash(password, method=method)
+
+def verify_password(stored, password):
+    # 返回 (是否匹配, 是否需要按当前参数重新哈希)
+    method = app.config['PASSWORD_HASH_METHOD']
+    if stored.startswith('$argon2'):
+        if PasswordHasher is None:
+            return False, False
+        hasher = _argon2_hasher(method) if method.startswith('argon2') else PasswordHasher()
+        try:
+            hasher.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False, False
+        return True, not method.startswith('argon2') or hasher.check_needs_rehash(stored)
+    if not check_password_hash(stored, password):
+        return False, False
+    return True, stored.split('$', 1)[0] != method
+
+# 令牌桶限流，超过 RATE_LIMIT_MAX_KEYS 个键时淘汰最久未使用的
+class RateLimiter:
+    def __init__(self, capacity, refill_rate, max_keys):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refill(self, key, now):
+        tokens, updated = self._buckets.pop(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.refill_rate)
+
+    def _store(self, key, tokens, now):
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def wait(self, key):
+        # 不消耗令牌：返回 0 表示允许，否则返回需要等待的秒数
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refill(key, now)
+            self._store(key, tokens, now)
+            return 0 if tokens >= 1 else (1 - tokens) / self.refill_rate
+
+    def charge(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._store(key, max(0, self._refill(key, now) - 1), now)
+
+_login_limiter = None
+
+def login_limiter():
+    global _login_limiter
+    if _login_limiter is None:
+        _login_limiter = RateLimiter(app.config['LOGIN_RATE_LIMIT_CAPACITY'],
+                                     app.config['LOGIN_RATE_LIMIT_REFILL'],
+                                     app.config['RATE_LIMIT_MAX_KEYS'])
+    return _login_limiter
+
+@app.cli.command('bench-password-hash')
+@click.argument('methods', nargs=-1)
+@click.option('--rounds', default=5, show_default=True)
+def bench_password_hash_command(methods, rounds):
+    """测量各哈希参数在本机上单次计算的耗时，用于选择 PASSWORD_HASH_METHOD"""
+    methods = methods or ('pbkdf2:sha256:600000', 'pbkdf2:sha256:200000',
+                          'scrypt:32768:8:1', 'scrypt:16384:8:1', 'scrypt:8192:8:1')
+    for method in methods:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            hash_password('benchmark-password', method)
+        print(f'{method:<28}{(time.perf_counter() - start) / rounds * 1000:>10.1f} ms')
+
+# 服务端会话：Cookie 中只保存随机会话 ID，会话内容保存在服务端
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        # 登录时更换会话 ID，防止会话固定攻击
+        if not self.new:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+class SQLiteSessionStore:
+    def __init__(self, cache):
+        self.cache = cache
+
+    def load(self, sid):
+        data = self.cache.get(sid)
+        if data is None:
+            row = DB.execute("SELECT data FROM sessions WHERE id = ? AND expires_at > ?", (sid, time.time()),
+                             primary=True)
+            if not row:
+                return None
+            data = json.loads(row[0]['data'])
+            self.cache.set(sid, data)
+        return data
+
+    def save(self, sid, data, expires_at):
+        DB.execute(
+            '''
+            INSERT INTO sessions (id, user_id, data, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                user_id = excluded.user_id, data = excluded.data, expires_at = excluded.expires_at
+            ''',
+            (sid, data.get('user_id'), json.dumps(data), expires_at),
+            commit=True
+        )
+        self.cache.set(sid, data)
+
+    def delete(self, sid):
+        # 返回被删除会话所属的用户 id（匿名会话或会话不存在时为 None）
+        user_id = DB.execute("DELETE FROM sessions WHERE id = ? RETURNING user_id", (sid,), commit=True)
+        self.cache.delete(sid)
+        return user_id
+
+    def revoke_user(self, user_id):
+        for row in DB.execute("SELECT id FROM sessions WHERE user_id = ?", (user_id,), primary=True):
+            self.cache.delete(row['id'])
+        DB.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,), commit=True)
+
+    def purge_expired(self):
+        DB.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),), commit=True)
+
+class RedisSessionStore:
+    def __init__(self, url, cache):
+        if redis is None:
+            raise RuntimeError('SESSION_BACKEND 为 redis 时需要安装 redis 包')
+        self.client = redis.Redis.from_url(url)
+        self.cache = cache
+
+    def load(self, sid):
+        data = self.cache.get(sid)
+        if data is None:
+            raw = self.client.get(f'session:{sid}')
+            if raw is None:
+                return None
+            data = json.loads(raw)
+            self.cache.set(sid, data)
+        return data
+
+    def save(self, sid, data, expires_at):
+        self.client.set(f'session:{sid}', json.dumps(data), ex=max(int(expires_at - time.time()), 1))
+        if data.get('user_id') is not None:
+            self.client.sadd(f"user_sessions:{data['user_id']}", sid)
+        self.cache.set(sid, data)
+
+    def delete(self, sid):
+        pipe = self.client.pipeline()
+        pipe.get(f'session:{sid}')
+        pipe.delete(f'session:{sid}')
+        raw, _ = pipe.execute()
+        self.cache.delete(sid)
+        return json.loads(raw).get('user_id') if raw is not None else None
+
+    def revoke_user(self, user_id):
+        for sid in self.client.smembers(f'user_sessions:{user_id}'):
+            self.delete(sid.decode())
+        self.client.delete(f'user_sessions:{user_id}')
+
+    def purge_expired(self):
+        # Redis 按过期时间自动删除
+        pass
+
+_session_store = None
+_user_cache = None
+
+def get_session_store():
+    global _session_store
+    if _session_store is None:
+        cache = LRUCache(app.config['SESSION_CACHE_MAX_ENTRIES'], app.config['SESSION_CACHE_TTL'])
+        if app.config['SESSION_BACKEND'] == 'redis':
+            _session_store = RedisSessionStore(app.config['CACHE_REDIS_URL'], cache)
+        else:
+            _session_store = SQLiteSessionStore(cache)
+    return _session_store
+
+class ServerSessionInterface(SessionInterface):
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = get_session_store().load(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        store = get_session_store()
+        # 删除已登录的会话（退出登录、重新登录替换旧会话）时通知其他进程丢弃缓存中的该会话
+        if session.previous_sid:
+            record_revocation(store.delete(session.previous_sid))
+
+        if not session:
+            if session.modified and not session.new:
+                record_revocation(store.delete(session.sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        store.save(session.sid, dict(session), time.time() + app.permanent_session_lifetime.total_seconds())
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+app.session_interface = ServerSessionInterface()
+
+def start_session(user_id):
+    session.clear()
+    session.regenerate()
+    session['user_id'] = user_id
+
+# 用户记录缓存：鉴权只需一次字典查找
+def user_cache():
+    global _user_cache
+    if _user_cache is None:
+        _user_cache = LRUCache(app.config['USER_CACHE_MAX_ENTRIES'], app.config['USER_CACHE_TTL'])
+    return _user_cache
+
+# 跨进程失效：改角色、删除用户、删除已登录的会话后追加一条 auth_revocations 记录（在修改提交之后写入）。
+# 各进程每 AUTH_REVOCATION_POLL_INTERVAL 秒按自增 id 读取一次新记录，移除对应的用户缓存并清空会话缓存
+_revocations_seen = None
+_revocations_checked_at = 0
+_revocations_lock = threading.Lock()
+
+def record_revocation(user_id):
+    if user_id is not None:
+        DB.execute("INSERT INTO auth_revocations (user_id, created_at) VALUES (?, ?)", (user_id, time.time()),
+                   commit=True)
+
+def revoke_cached_user(user_id):
+    user_cache().delete(user_id)
+    record_revocation(user_id)
+
+def apply_revocations():
+    global _revocations_seen, _revocations_checked_at
+    now = time.monotonic()
+    with _revocations_lock:
+        seen = _revocations_seen
+        if seen is not None and now - _revocations_checked_at < app.config['AUTH_REVOCATION_POLL_INTERVAL']:
+            return set()
+        _revocations_checked_at = now
+    if seen is None:
+        # 进程内首次检查：此前的记录不影响尚未建立的缓存
+        latest = DB.execute("SELECT COALESCE(MAX(id), 0) AS id FROM auth_revocations", primary=True)[0]['id']
+        with _revocations_lock:
+            if _revocations_seen is None:
+                _revocations_seen = latest
+        return set()
+    rows = DB.execute("SELECT id, user_id FROM auth_revocations WHERE id > ? ORDER BY id", (seen,), primary=True)
+    if not rows:
+        return set()
+    with _revocations_lock:
+        _revocations_seen = max(_revocations_seen, rows[-1]['id'])
+    revoked = {row['user_id'] for row in rows}
+    for user_id in revoked:
+        user_cache().delete(user_id)
+    get_session_store().cache.clear()
+    return revoked
+
+def get_user(user_id):
+    user = user_cache().get(user_id)
+    if user is None:
+        row = DB.execute("SELECT id, username, role FROM users WHERE id = ?", (user_id,), primary=True)
+        if not row:
+            return None
+        user = dict(row[0])
+        user_cache().set(user_id, user)
+    return user
+
+@app.before_request
+def load_current_user():
+    g.user = None
+    if 'user_id' in session:
+        if session['user_id'] in apply_revocations() and get_session_store().load(session.sid) is None:
+            # 会话已在其他进程中被撤销，本请求读到的是缓存中的旧会话
+            session.clear()
+            return
+        g.user = get_user(session['user_id'])
+        if g.user is None:
+            # 用户已被删除，会话随之失效
+            session.clear()
+
+@app.cli.command('purge-sessions')
+def purge_sessions_command():
+    """删除已过期的会话"""
+    get_session_store().purge_expired()
+    # 超过缓存 TTL 的失效记录已无作用：对应缓存条目已自然过期
+    ttl = max(app.config['SESSION_CACHE_TTL'], app.config['USER_CACHE_TTL'])
+    DB.execute("DELETE FROM auth_revocations WHERE created_at < ?", (time.time() - ttl,), commit=True)
+    print('已清理过期会话')
+
+# 装饰器
+def login_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if g.user is None:
+            return json_response('请先登录', 401)
+        return f(*args, **kwargs)
+    return decorated
+
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if g.user is None:
+            return json_response('请先登录', 401)
+        if g.user['role'] != 'admin':
+            return json_response('需要管理员权限', 403)
+        return f(*args, **kwargs)
+    return decorated
+
+# 响应辅助函数
+def json_response(message=None, status=200, data=None, etag=None):
+    response = {'success': status == 200}
+    if message:
+        response['message'] = message
+    if data is not None:
+        response['data'] = data
+    resp = jsonify(response)
+    resp.status_code = status
+    if etag:
+        resp.set_etag(etag)
+    return compress_response(resp)
+
+def compress_response(resp):
+    if len(resp.get_data()) < app.config['COMPRESS_MIN_SIZE']:
+        return resp
+    resp.vary.add('Accept-Encoding')
+    if brotli is not None and request.accept_encodings['br']:
+        encoding, body = 'br', brotli.compress(resp.get_data())
+    elif request.accept_encodings['gzip']:
+        encoding, body = 'gzip', gzip.compress(resp.get_data(), compresslevel=app.config['COMPRESS_LEVEL'])
+    else:
+        return resp
+    resp.set_data(body)
+    resp.headers['Content-Encoding'] = encoding
+    # 不同编码的表示必须使用不同的强 ETag
+    etag, weak = resp.get_etag()
+    if etag:
+        resp.set_etag(f'{etag}-{encoding}', weak)
+    return resp
+
+# 目录类接口的 ETag 由对应范围的版本号和缓存键派生，命中 If-None-Match 时无需查询和序列化
+def catalog_etag(cache_key, scope):
+    digest = hashlib.sha1(cache_key.encode()).hexdigest()[:16]
+    return f'{get_cache().version(scope)}-{digest}'
+
+def not_modified(etag):
+    if_none_match = request.if_none_match
+    for candidate in (etag, f'{etag}-gzip', f'{etag}-br'):
+        if if_none_match.contains_weak(candidate):
+            resp = app.response_class(status=304)
+            resp.set_etag(candidate)
+            return resp
+    return None
+
+# 收藏标记：目录缓存在用户间共享，is_favorite 在缓存之后按页注入，ETag 附加用户的收藏版本号
+_favorite_versions = None
+_favorite_versions_lock = threading.Lock()
+
+def favorite_versions():
+    global _favorite_versions
+    with _favorite_versions_lock:
+        if _favorite_versions is None:
+            if app.config['CACHE_BACKEND'] == 'redis':
+                # 独立的命名空间，清空响应缓存时不受影响
+                _favorite_versions = RedisCache(app.config['CACHE_REDIS_URL'], app.config['FAVORITES_VERSION_TTL'],
+                                                namespace='music-favorites:')
+            else:
+                _favorite_versions = LRUCache(app.config['FAVORITES_VERSION_MAX_ENTRIES'],
+                                              app.config['FAVORITES_VERSION_TTL'])
+        return _favorite_versions
+
+def favorites_version(user_id, bump=False):
+    versions = favorite_versions()
+    key = str(user_id)
+    version = None if bump else versions.get(key)
+    if version is None:
+        version = secrets.token_hex(4)
+        versions.set(key, version)
+    return version
+
+def personal_etag(etag):
+    if g.user is None:
+        return etag
+    return f"{etag}-u{g.user['id']}.{favorites_version(g.user['id'])}"
+
+def mark_favorites(songs_data):
+    favorited = set()
+    if g.user is not None and songs_data:
+        ids = {song['id'] for song in songs_data}
+        placeholders = ','.join('?' * len(ids))
+        rows = DB.execute(
+            f"SELECT song_id FROM favorites WHERE user_id = ? AND song_id IN ({placeholders})",
+            (g.user['id'], *ids)
+        )
+        favorited = {row['song_id'] for row in rows}
+    # 复制后再标记，避免改动缓存中的对象
+    return [dict(song, is_favorite=song['id'] in favorited) for song in songs_data]
+
+# 分页游标：对 (排序值, id) 做 base64 编码，客户端视为不透明字符串
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(sort_value, (str, int, float)):
+            return None
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+# 解析分页参数 limit，非法时返回 None
+def page_limit(default, maximum):
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        return None
+    if limit < 1:
+        return None
+    return min(limit, maximum)
+
+# music 行转为字典，cover_variants、categories、tags 以 JSON 文本存储
+def song_dict(row):
+    song = dict(row)
+    if 'cover_variants' in song:
+        song['cover_variants'] = json.loads(song['cover_variants']) if song['cover_variants'] else {}
+    for field in ('categories', 'tags'):
+        if field in song:
+            song[field] = json.loads(song[field]) if song[field] else []
+    return song
+
+# 数据库迁移：按版本号顺序执行，当前版本记录在 PRAGMA user_version 中
+MUSIC_TABLE = '''
+    CREATE TABLE IF NOT EXISTS music (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        album TEXT,
+        duration TEXT,
+        cover_path TEXT,
+        audio_path TEXT,
+        genre TEXT,
+        release_date TEXT,
+        lyrics TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+MUSIC_TABLE_FIELDS = ('id', 'title', 'artist', 'album', 'duration', 'cover_path',
+                      'audio_path', 'genre', 'release_date', 'lyrics', 'created_at')
+
+def migration_initial_schema():
+    tables = [
+        MUSIC_TABLE,
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT,
+            role TEXT DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            song_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (song_id) REFERENCES music (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS favorites (
+            user_id INTEGER NOT NULL,
+            song_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, song_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (song_id) REFERENCES music (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            description TEXT,
+            type TEXT DEFAULT 'category',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS song_categories (
+            song_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            PRIMARY KEY (song_id, category_id),
+            FOREIGN KEY (song_id) REFERENCES music (id),
+            FOREIGN KEY (category_id) REFERENCES categories (id)
+        )
+        '''
+    ]
+
+    for table in tables:
+        DB.execute(table)
+
+def migration_music_columns():
+    # 早期版本的 music 表缺少 audio_path/genre/release_date/lyrics/created_at，
+    # created_at 的默认值无法通过 ALTER TABLE 添加，因此整表重建
+    columns = [row['name'] for row in DB.execute("SELECT name FROM pragma_table_info('music')")]
+    if all(field in columns for field in MUSIC_TABLE_FIELDS):
+        return
+    # 先建新表再改名，避免 RENAME 改写其他表中指向 music 的外键
+    common = ', '.join(field for field in MUSIC_TABLE_FIELDS if field in columns)
+    DB.execute(MUSIC_TABLE.replace('music', 'music_new', 1))
+    DB.execute(f"INSERT INTO music_new ({common}) SELECT {common} FROM music")
+    DB.execute("DROP TABLE music")
+    DB.execute("ALTER TABLE music_new RENAME TO music")
+
+def migration_indexes():
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_music_created ON music (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_music_genre_created ON music (genre, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_music_artist_created ON music (artist, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_comments_song_created ON comments (song_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_favorites_song ON favorites (song_id)",
+        "CREATE INDEX IF NOT EXISTS idx_song_categories_category ON song_categories (category_id, song_id)"
+    ]
+    for index in indexes:
+        DB.execute(index)
+
+def migration_related_songs():
+    DB.execute('''
+        CREATE TABLE IF NOT EXISTS related_songs (
+            song_id INTEGER NOT NULL,
+            related_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (song_id, related_id),
+            FOREIGN KEY (song_id) REFERENCES music (id),
+            FOREIGN KEY (related_id) REFERENCES music (id)
+        )
+    ''')
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_related_songs_score ON related_songs (song_id, score)")
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_related_songs_related ON related_songs (related_id)")
+    # 单列索引的条目按 rowid 排序，用于同流派内按 id 区间随机取样
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_music_genre ON music (genre)")
+    for row in DB.execute("SELECT id FROM music"):
+        refresh_related(row['id'])
+
+def migration_comment_count():
+    DB.execute("ALTER TABLE music ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0")
+    DB.execute('''
+        UPDATE music SET comment_count = (
+            SELECT COUNT(*) FROM comments WHERE comments.song_id = music.id
+        )
+    ''')
+
+def migration_search_index():
+    # 索引内容经过 segment_text 处理（中日韩文字逐字切分），因此不使用外部内容表，由写入路径同步
+    DB.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS music_fts USING fts5(
+            title, artist, album, lyrics, categories,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    # 索引内容在迁移 12 中统一回填（index_song 依赖 music.categories 列）
+
+def migration_cover_variants():
+    DB.execute("ALTER TABLE music ADD COLUMN cover_variants TEXT")
+
+def migration_uploads():
+    DB.execute('''
+        CREATE TABLE IF NOT EXISTS uploads (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+def migration_audio_metadata():
+    DB.execute("ALTER TABLE music ADD COLUMN duration_seconds REAL")
+    DB.execute("ALTER TABLE music ADD COLUMN bitrate INTEGER")
+    DB.execute("ALTER TABLE music ADD COLUMN sample_rate INTEGER")
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_music_duration ON music (duration_seconds, id)")
+
+def migration_sessions():
+    DB.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id)")
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+
+def migration_favorite_counts():
+    DB.execute("ALTER TABLE music ADD COLUMN favorite_count INTEGER NOT NULL DEFAULT 0")
+    DB.execute('''
+        UPDATE music SET favorite_count = (
+            SELECT COUNT(*) FROM favorites WHERE favorites.song_id = music.id
+        )
+    ''')
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_music_favorite_count ON music (favorite_count, id)")
+    # 每首歌每天新增（且仍未取消）的收藏数，用于日榜、周榜
+    DB.execute('''
+        CREATE TABLE IF NOT EXISTS favorite_buckets (
+            day TEXT NOT NULL,
+            song_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, song_id),
+            FOREIGN KEY (song_id) REFERENCES music (id)
+        )
+    ''')
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_favorite_buckets_song ON favorite_buckets (song_id)")
+    DB.execute('''
+        INSERT INTO favorite_buckets (day, song_id, count)
+        SELECT date(created_at), song_id, COUNT(*) FROM favorites
+        GROUP BY date(created_at), song_id
+    ''')
+
+def migration_song_categories():
+    DB.execute("ALTER TABLE music ADD COLUMN categories TEXT")
+    DB.execute("ALTER TABLE music ADD COLUMN tags TEXT")
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_categories_type ON categories (type, name)")
+    DB.execute('''
+        UPDATE music SET
+            categories = (
+                SELECT json_group_array(name) FROM (
+                    SELECT c.name FROM song_categories sc
+                    JOIN categories c ON sc.category_id = c.id
+                    WHERE sc.song_id = music.id ORDER BY c.id
+                )
+            ),
+            tags = (
+                SELECT json_group_array(name) FROM (
+                    SELECT c.name FROM song_categories sc
+                    JOIN categories c ON sc.category_id = c.id
+                    WHERE sc.song_id = music.id AND c.type = 'tag' ORDER BY c.id
+                )
+            )
+        WHERE id IN (SELECT song_id FROM song_categories)
+    ''')
+    for row in DB.execute("SELECT id FROM music"):
+        index_song(row['id'])
+
+def migration_duration_sort_indexes():
+    # 按流派或歌手筛选并按时长排序时直接按索引顺序分页，不必对整个流派排序
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_music_genre_duration ON music (genre, duration_seconds, id)")
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_music_artist_duration ON music (artist, duration_seconds, id)")
+
+def migration_auth_revocations():
+    # 删除用户时按 user_id 查找评论，避免在写事务中全表扫描
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_comments_user ON comments (user_id, song_id)")
+    DB.execute('''
+        CREATE TABLE IF NOT EXISTS auth_revocations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+
+def migration_catalog_version():
+    # 单行表：曲库写入次数与只读副本已同步到的版本，见 ReplicaSync
+    DB.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            synced_version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    DB.execute("INSERT INTO catalog_version (id) VALUES (1) ON CONFLICT DO NOTHING")
+
+
+MIGRATIONS = [
+    (1, '初始表结构', migration_initial_schema),
+    (2, '补齐 music 表字段', migration_music_columns),
+    (3, '查询索引', migration_indexes),
+    (4, '相关歌曲表', migration_related_songs),
+    (5, '评论计数', migration_comment_count),
+    (6, '全文搜索索引', migration_search_index),
+    (7, '封面衍生图', migration_cover_variants),
+    (8, '分片上传', migration_uploads),
+    (9, '音频元数据', migration_audio_metadata),
+    (10, '服务端会话', migration_sessions),
+    (11, '收藏计数', migration_favorite_counts),
+    (12, '歌曲分类冗余列', migration_song_categories),
+    (13, '流派/歌手内按时长排序的索引', migration_duration_sort_indexes),
+    (14, '按用户删除评论的索引和鉴权失效记录', migration_auth_revocations),
+    (15, '副本同步的曲库版本', migration_catalog_version)
+]
+
+# PostgreSQL 没有迁移历史，直接按当前版本建表，版本号与 MIGRATIONS 保持一致；修改表结构时两边都要更新。
+# 时间列沿用 SQLite CURRENT_TIMESTAMP 的文本格式；与 SQLite（未开启 foreign_keys）一致，不声明外键
+PG_TIMESTAMP = "TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+
+def pg_migration_schema():
+    statements = [
+        f'''
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT,
+            role TEXT DEFAULT 'user',
+            created_at {PG_TIMESTAMP}
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS music (
+            id SERIAL PRIMARY KEY,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            album TEXT,
+            duration TEXT,
+            duration_seconds DOUBLE PRECISION,
+            bitrate INTEGER,
+            sample_rate INTEGER,
+            cover_path TEXT,
+            cover_variants TEXT,
+            audio_path TEXT,
+            genre TEXT,
+            release_date TEXT,
+            lyrics TEXT,
+            categories TEXT,
+            tags TEXT,
+            comment_count INTEGER NOT NULL DEFAULT 0,
+            favorite_count INTEGER NOT NULL DEFAULT 0,
+            created_at {PG_TIMESTAMP}
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS comments (
+            id SERIAL PRIMARY KEY,
+            song_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at {PG_TIMESTAMP}
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS favorites (
+            user_id INTEGER NOT NULL,
+            song_id INTEGER NOT NULL,
+            created_at {PG_TIMESTAMP},
+            PRIMARY KEY (user_id, song_id)
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS categories (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            description TEXT,
+            type TEXT DEFAULT 'category',
+            created_at {PG_TIMESTAMP}
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS song_categories (
+            song_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            PRIMARY KEY (song_id, category_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS related_songs (
+            song_id INTEGER NOT NULL,
+            related_id INTEGER NOT NULL,
+            score DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (song_id, related_id)
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS uploads (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            size BIGINT NOT NULL,
+            sha256 TEXT NOT NULL,
+            path TEXT,
+            created_at {PG_TIMESTAMP}
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            data TEXT NOT NULL,
+            expires_at DOUBLE PRECISION NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS favorite_buckets (
+            day TEXT NOT NULL,
+            song_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, song_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_music_created ON music (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_music_genre_created ON music (genre, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_music_artist_created ON music (artist, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_music_genre ON music (genre)",
+        "CREATE INDEX IF NOT EXISTS idx_music_duration ON music (duration_seconds, id)",
+        "CREATE INDEX IF NOT EXISTS idx_music_favorite_count ON music (favorite_count, id)",
+        "CREATE INDEX IF NOT EXISTS idx_comments_song_created ON comments (song_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_favorites_user_created ON favorites (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_favorites_song ON favorites (song_id)",
+        "CREATE INDEX IF NOT EXISTS idx_song_categories_category ON song_categories (category_id, song_id)",
+        "CREATE INDEX IF NOT EXISTS idx_categories_type ON categories (type, name)",
+        "CREATE INDEX IF NOT EXISTS idx_related_songs_score ON related_songs (song_id, score)",
+        "CREATE INDEX IF NOT EXISTS idx_related_songs_related ON related_songs (related_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)",
+        "CREATE INDEX IF NOT EXISTS idx_favorite_buckets_song ON favorite_buckets (song_id)"
+    ]
+    for statement in statements:
+        DB.execute(statement)
+
+def pg_migration_auth_revocations():
+    DB.execute("CREATE INDEX IF NOT EXISTS idx_comments_user ON comments (user_id, song_id)")
+    DB.execute('''
+        CREATE TABLE IF NOT EXISTS auth_revocations (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at DOUBLE PRECISION NOT NULL
+        )
+    ''')
+
+PG_MIGRATIONS = [
+    (12, 'PostgreSQL 表结构', pg_migration_schema),
+    (13, '流派/歌手内按时长排序的索引', migration_duration_sort_indexes),
+    (14, '按用户删除评论的索引和鉴权失效记录', pg_migration_auth_revocations),
+    (15, '副本同步的曲库版本', migration_catalog_version)
+]
+
+def active_migrations():
+    return MIGRATIONS if get_backend().name == 'sqlite' else PG_MIGRATIONS
+
+def schema_version():
+    return get_backend().schema_version()
+
+def migrate():
+    applied = []
+    current = schema_version()
+    for version, description, migration in active_migrations():
+        if version <= current:
+            continue
+        with DB.transaction():
+            migration()
+            get_backend().set_schema_version(version)
+        applied.append((version, description))
+    return applied
+
+# 执行计划检查：路由中的查询不允许退化为全表扫描
+# 路由会执行的查询（参数只用于生成执行计划）。每项为 (查询, 参数) 或 (查询, 参数, 允许的计划明细)：
+# 第三项列出已确认规模有界的例外，需注明原因。新增或修改路由查询时同步更新此列表；
+# 引用了后文定义的常量，因此在调用时构造
+def query_plan_checks():
+    return [
+        # 登录、会话与鉴权
+        ("SELECT id, username, password, role FROM users WHERE username = ?", ('admin',)),
+        ("SELECT id, username, role FROM users WHERE id = ?", (1,)),
+        ("UPDATE users SET password = ? WHERE id = ?", ('x', 1)),
+        ("SELECT data FROM sessions WHERE id = ? AND expires_at > ?", ('sid', 0.0)),
+        ("DELETE FROM sessions WHERE id = ? RETURNING user_id", ('sid',)),
+        ("SELECT synced_version FROM catalog_version WHERE id = 1", ()),
+        ("UPDATE catalog_version SET version = version + 1 WHERE id = 1", ()),
+        ("SELECT id FROM sessions WHERE user_id = ?", (1,)),
+        ("DELETE FROM sessions WHERE user_id = ?", (1,)),
+        ("DELETE FROM sessions WHERE expires_at <= ?", (0.0,)),
+        ("SELECT COALESCE(MAX(id), 0) AS id FROM auth_revocations", ()),
+        ("SELECT id, user_id FROM auth_revocations WHERE id > ? ORDER BY id", (0,)),
+        ("DELETE FROM auth_revocations WHERE created_at < ?", (0.0,),
+         # 仅由 purge-sessions 定期执行，表中只保留最近一个缓存 TTL 内的少量记录
+         ('SCAN auth_revocations',)),
+
+        # 歌曲列表：各排序、筛选组合，带游标和不带游标
+        ('''
+            SELECT m.id, m.title FROM music m
+            ORDER BY m.created_at DESC, m.id DESC LIMIT ?
+        ''', (50,)),
+        ('''
+            SELECT m.id, m.title FROM music m
+            WHERE (m.created_at, m.id) < (?, ?)
+            ORDER BY m.created_at DESC, m.id DESC LIMIT ?
+        ''', ('2024-01-01', 1, 50)),
+        ('''
+            SELECT m.id, m.title FROM music m
+            WHERE m.genre = ? AND (m.created_at, m.id) < (?, ?)
+            ORDER BY m.created_at DESC, m.id DESC LIMIT ?
+        ''', ('pop', '2024-01-01', 1, 50)),
+        ('''
+            SELECT m.id, m.title FROM music m
+            WHERE m.artist = ?
+            ORDER BY m.created_at DESC, m.id DESC LIMIT ?
+        ''', ('artist', 50)),
+        ('''
+            SELECT m.id, m.title FROM music m
+            WHERE +m.duration_seconds >= ? AND +m.duration_seconds <= ?
+            ORDER BY m.created_at DESC, m.id DESC LIMIT ?
+        ''', (120.0, 300.0, 50)),
+        ('''
+            SELECT m.id, m.title FROM song_categories sc CROSS JOIN music m
+            WHERE sc.category_id = (SELECT id FROM categories WHERE name = ?) AND m.id = sc.song_id
+            ORDER BY m.created_at DESC, m.id DESC LIMIT ?
+        ''', ('category', 50),
+         # 从单个分类的歌曲出发，只对该分类下的歌曲排序
+         ('USE TEMP B-TREE FOR ORDER BY',)),
+        ('''
+            SELECT m.id, m.title FROM music m
+            WHERE m.duration_seconds IS NOT NULL AND m.duration_seconds <= ?
+              AND (m.duration_seconds, m.id) > (?, ?)
+            ORDER BY m.duration_seconds ASC, m.id ASC LIMIT ?
+        ''', (300.0, 120.0, 1, 50)),
+        ('''
+            SELECT m.id, m.title FROM music m
+            WHERE m.duration_seconds IS NOT NULL AND m.genre = ?
+            ORDER BY m.duration_seconds DESC, m.id DESC LIMIT ?
+        ''', ('pop', 50)),
+        ('''
+            SELECT m.id, m.title FROM music m
+            WHERE m.duration_seconds IS NOT NULL AND m.artist = ? AND (m.duration_seconds, m.id) > (?, ?)
+            ORDER BY m.duration_seconds ASC, m.id ASC LIMIT ?
+        ''', ('artist', 120.0, 1, 50)),
+
+        # 歌曲详情、相关歌曲、播放
+        ("SELECT * FROM music WHERE id = ?", (1,)),
+        ('''
+            SELECT m.id, m.title, m.artist, m.album, m.cover_path
+            FROM related_songs r
+            JOIN music m ON r.related_id = m.id
+            WHERE r.song_id = ?
+            ORDER BY r.score DESC
+            LIMIT ?
+        ''', (1, 3)),
+        ("SELECT MIN(id) AS low, MAX(id) AS high FROM music WHERE genre = ?", ('pop',)),
+        ('''
+            SELECT id, title, artist, album, cover_path
+            FROM music
+            WHERE genre = ? AND id >= ? AND id != ?
+            ORDER BY id
+            LIMIT ?
+        ''', ('pop', 1, 1, 3)),
+        ('''
+            SELECT id, title, artist, album, cover_path
+            FROM music
+            WHERE genre = ? AND id < ? AND id != ?
+            ORDER BY id
+            LIMIT ?
+        ''', ('pop', 1, 1, 3)),
+        ("SELECT audio_path FROM music WHERE id = ?", (1,)),
+
+        # 评论
+        ("SELECT id, comment_count FROM music WHERE id = ?", (1,)),
+        ('''
+            SELECT c.*, u.username
+            FROM comments c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.song_id = ?
+            ORDER BY c.created_at DESC, c.id DESC
+            LIMIT ?
+        ''', (1, 20)),
+        ('''
+            SELECT c.*, u.username
+            FROM comments c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.song_id = ? AND (c.created_at, c.id) < (?, ?)
+            ORDER BY c.created_at DESC, c.id DESC
+            LIMIT ?
+        ''', (1, '2024-01-01', 1, 20)),
+        ("UPDATE music SET comment_count = comment_count + 1 WHERE id = ?", (1,)),
+        ('''
+            SELECT c.*, u.username
+            FROM comments c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.id = ?
+        ''', (1,)),
+        ("SELECT * FROM comments WHERE id = ?", (1,)),
+        ("DELETE FROM comments WHERE id = ? RETURNING song_id", (1,)),
+
+        # 搜索：FTS5 按 bm25 排序，排序只涉及命中的行
+        (f'''
+            SELECT m.id, m.title
+            FROM (
+                SELECT rowid, bm25(music_fts, {', '.join(str(w) for w in SEARCH_WEIGHTS)}) AS score
+                FROM music_fts
+                WHERE music_fts MATCH ?
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            ) hits
+            JOIN music m ON m.id = hits.rowid
+            ORDER BY hits.score
+        ''', ('"love"*', 20, 0), ('USE TEMP B-TREE FOR ORDER BY',)),
+
+        # 分类
+        ('''
+            SELECT c.id, c.name, c.description, c.type,
+                   (SELECT COUNT(*) FROM song_categories sc WHERE sc.category_id = c.id) AS song_count
+            FROM categories c
+            WHERE c.type = ?
+            ORDER BY c.type, c.name
+        ''', ('tag',)),
+        ('''
+            SELECT c.id, c.name, c.description, c.type,
+                   (SELECT COUNT(*) FROM song_categories sc WHERE sc.category_id = c.id) AS song_count
+            FROM categories c
+            ORDER BY c.type, c.name
+        ''', (),
+         # 分类是管理员维护的小表，完整返回
+         ('SCAN c USING INDEX idx_categories_type',)),
+        ('''
+            SELECT sc.song_id, c.name, c.type
+            FROM song_categories sc
+            JOIN categories c ON sc.category_id = c.id
+            WHERE sc.song_id IN (?, ?)
+            ORDER BY c.id
+        ''', (1, 2),
+         # 只对本批歌曲的分类排序
+         ('USE TEMP B-TREE FOR ORDER BY',)),
+        ("SELECT id FROM categories WHERE id = ?", (1,)),
+        ("UPDATE categories SET name = ?, description = ?, type = ? WHERE id = ?", ('n', None, 'tag', 1)),
+        ("DELETE FROM categories WHERE id = ?", (1,)),
+        ("SELECT song_id FROM song_categories WHERE category_id = ?", (1,)),
+        ("DELETE FROM song_categories WHERE category_id = ?", (1,)),
+        ("DELETE FROM song_categories WHERE song_id = ? AND category_id = ?", (1, 1)),
+        ("SELECT id FROM music WHERE id IN (?, ?)", (1, 2)),
+        ("UPDATE music SET categories = ?, tags = ? WHERE id = ?", ('[]', '[]', 1)),
+
+        # 收藏与排行榜
+        ('''
+            SELECT m.*
+            FROM favorites f
+            JOIN music m ON f.song_id = m.id
+            WHERE f.user_id = ?
+            ORDER BY f.created_at DESC
+        ''', (1,)),
+        ("SELECT song_id FROM favorites WHERE user_id = ? AND song_id IN (?, ?)", (1, 1, 2)),
+        ('''
+            INSERT INTO favorite_buckets (day, song_id, count)
+            SELECT SUBSTR(created_at, 1, 10), song_id, 1 FROM favorites WHERE user_id = ? AND song_id = ?
+            ON CONFLICT (day, song_id) DO UPDATE SET count = favorite_buckets.count + 1
+        ''', (1, 1)),
+        ("SELECT SUBSTR(created_at, 1, 10) AS day FROM favorites WHERE user_id = ? AND song_id = ?", (1, 1)),
+        ("DELETE FROM favorites WHERE user_id = ? AND song_id = ?", (1, 1)),
+        ("UPDATE music SET favorite_count = favorite_count - 1 WHERE id = ?", (1,)),
+        ("UPDATE favorite_buckets SET count = count - 1 WHERE day = ? AND song_id = ?", ('2024-01-01', 1)),
+        ('''
+            SELECT m.id, m.title
+            FROM music m
+            WHERE m.favorite_count > 0
+            ORDER BY m.favorite_count DESC, m.id DESC
+            LIMIT ?
+        ''', (50,)),
+        ('''
+            SELECT m.id, m.title, b.window_count
+            FROM (
+                SELECT song_id, SUM(count) AS window_count
+                FROM favorite_buckets
+                WHERE day >= ?
+                GROUP BY song_id
+                HAVING SUM(count) > 0
+                ORDER BY window_count DESC, song_id DESC
+                LIMIT ?
+            ) b
+            JOIN music m ON m.id = b.song_id
+            ORDER BY b.window_count DESC, m.id DESC
+        ''', ('2024-01-01', 50),
+         # 只汇总窗口内（最多 7 天）的按天计数，结果按 CHARTS_CACHE_TTL 缓存
+         ('USE TEMP B-TREE FOR GROUP BY', 'USE TEMP B-TREE FOR ORDER BY', 'SCAN b')),
+
+        # 歌曲管理、批量导入导出
+        ("SELECT * FROM music ORDER BY created_at DESC", (),
+         # 管理后台的完整歌曲列表，按定义读取全表
+         ('SCAN music USING INDEX idx_music_created',)),
+        ("SELECT id FROM music WHERE id = ?", (1,)),
+        ('''
+            UPDATE music SET title = ?, artist = ?, album = ?, duration = ?, cover_path = ?,
+                audio_path = ?, genre = ?, release_date = ?, lyrics = ?
+            WHERE id = ?
+        ''', ('t', 'a', 'a', '1:00', 'c', 'a', 'pop', '2024', 'l', 1)),
+        ("DELETE FROM favorites WHERE song_id = ?", (1,)),
+        ("DELETE FROM favorite_buckets WHERE song_id = ?", (1,)),
+        ("DELETE FROM comments WHERE song_id = ?", (1,)),
+        ("DELETE FROM song_categories WHERE song_id = ?", (1,)),
+        ("DELETE FROM related_songs WHERE song_id = ? OR related_id = ?", (1, 1)),
+        ("SELECT song_id FROM related_songs WHERE related_id = ?", (1,)),
+        ("DELETE FROM music WHERE id = ?", (1,)),
+        ("SELECT id, title, artist, album, lyrics, categories FROM music WHERE id = ?", (1,)),
+        ("DELETE FROM music_fts WHERE rowid = ?", (1,)),
+        ("UPDATE music SET cover_variants = ? WHERE id = ? AND cover_path = ?", ('{}', 1, 'c')),
+        (AUDIO_METADATA_UPDATE, (1.0, 1, 1, '0:01', 1, 'a')),
+        ('''
+            SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'music'), 0),
+                COALESCE((SELECT MAX(id) FROM music), 0)
+            ) AS id
+        ''', (),
+         # sqlite_sequence 每个 AUTOINCREMENT 表一行
+         ('SCAN sqlite_sequence',)),
+        ("SELECT id, title FROM music WHERE id > ? ORDER BY id LIMIT ?", (0, 500)),
+
+        # 上传
+        ("SELECT * FROM uploads WHERE id = ?", ('id',)),
+        ("UPDATE uploads SET path = ? WHERE id = ?", ('p', 'id')),
+        ("DELETE FROM uploads WHERE id = ?", ('id',)),
+
+        # 用户管理：删除用户在写事务中执行，每条语句都必须走索引
+        ("SELECT id FROM users WHERE id = ?", (1,)),
+        ("UPDATE users SET role = ? WHERE id = ?", ('user', 1)),
+        ("SELECT song_id FROM comments WHERE user_id = ? UNION ALL SELECT song_id FROM favorites WHERE user_id = ?",
+         (1, 1)),
+        ('''
+            UPDATE music SET comment_count = comment_count - (
+                SELECT COUNT(*) FROM comments
+                WHERE comments.song_id = music.id AND comments.user_id = ?
+            )
+            WHERE id IN (SELECT song_id FROM comments WHERE user_id = ?)
+        ''', (1, 1)),
+        ("DELETE FROM comments WHERE user_id = ?", (1,)),
+        ('''
+            UPDATE music SET favorite_count = favorite_count - 1
+            WHERE id IN (SELECT song_id FROM favorites WHERE user_id = ?)
+        ''', (1,)),
+        ('''
+            UPDATE favorite_buckets SET count = count - 1
+            WHERE (day, song_id) IN (
+                SELECT SUBSTR(created_at, 1, 10), song_id FROM favorites WHERE user_id = ?
+            )
+        ''', (1,)),
+        ("DELETE FROM favorites WHERE user_id = ?", (1,)),
+        ("DELETE FROM users WHERE id = ?", (1,))
+    ]
+
+SQL_ORDERED_LIMIT = re.compile(r'\bORDER BY\b.*\bLIMIT\b', re.IGNORECASE | re.DOTALL)
+PLAN_SUBQUERY = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\S+)')
+
+def plan_problem(detail, query, subqueries):
+    # 返回计划明细中的问题说明，没有问题时返回 None
+    if detail.startswith('USE TEMP B-TREE'):
+        return '结果需要临时排序'
+    if not detail.startswith('SCAN '):
+        return None
+    name = detail.split()[1]
+    if name in subqueries or name == 'CONSTANT':
+        # 子查询结果的扫描，其内部计划单独检查
+        return None
+    if ' USING ' not in detail and ' VIRTUAL TABLE INDEX ' not in detail:
+        return '全表扫描'
+    if ' VIRTUAL TABLE INDEX ' not in detail and not SQL_ORDERED_LIMIT.search(query):
+        # 按索引顺序遍历只在 ORDER BY ... LIMIT 中可以提前结束
+        return '按索引遍历整张表'
+    return None
+
+def check_query_plans():
+    # 返回 [(查询, 问题, 执行计划明细)]
+    failures = []
+    for check in query_plan_checks():
+        query, params = check[:2]
+        allowed = check[2] if len(check) > 2 else ()
+        with DB.connection() as conn:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        subqueries = {match.group(1) for match in (PLAN_SUBQUERY.match(row['detail']) for row in plan) if match}
+        for row in plan:
+            detail = row['detail']
+            problem = plan_problem(detail, query, subqueries)
+            if problem and not any(detail.startswith(prefix) for prefix in allowed):
+                failures.append((' '.join(query.split()), problem, detail))
+    return failures
+
+@app.cli.command('migrate')
+def migrate_command():
+    """执行数据库迁移"""
+    for version, description in migrate():
+        print(f'已迁移到版本 {version}: {description}')
+    print(f'当前数据库版本: {schema_version()}')
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """检查路由查询的执行计划，存在全表扫描、整表索引遍历或临时排序时以非零状态退出"""
+    if get_backend().name != 'sqlite':
+        print('执行计划检查仅支持 SQLite')
+        raise SystemExit(1)
+    if schema_version() < MIGRATIONS[-1][0]:
+        print('数据库版本过旧，请先执行 flask migrate')
+        raise SystemExit(1)
+    failures = check_query_plans()
+    for query, problem, detail in failures:
+        print(f'{problem}（{detail}）: {query}')
+    if failures:
+        raise SystemExit(1)
+    print('所有查询均使用索引')
+
+# 相关歌曲：按共同收藏数和共同分类/标签数打分，结果存入 related_songs，详情页直接查表
+def refresh_related(song_id):
+    candidates = DB.execute('''
+        SELECT candidate, SUM(score) AS score
+        FROM (
+            SELECT f2.song_id AS candidate, COUNT(*) * ? AS score
+            FROM favorites f1
+            JOIN favorites f2 ON f1.user_id = f2.user_id AND f2.song_id != f1.song_id
+            WHERE f1.song_id = ?
+            GROUP BY f2.song_id
+            UNION ALL
+            SELECT sc2.song_id AS candidate, COUNT(*) * ? AS score
+            FROM song_categories sc1
+            JOIN song_categories sc2 ON sc1.category_id = sc2.category_id AND sc2.song_id != sc1.song_id
+            WHERE sc1.song_id = ?
+            GROUP BY sc2.song_id
+        ) candidates
+        GROUP BY candidate
+        ORDER BY score DESC
+        LIMIT ?
+    ''', (app.config['RELATED_WEIGHT_FAVORITE'], song_id,
+          app.config['RELATED_WEIGHT_CATEGORY'], song_id,
+          app.config['RELATED_SONGS_STORED']))
+
+    with DB.transaction():
+        DB.execute("DELETE FROM related_songs WHERE song_id = ?", (song_id,))
+        DB.executemany(
+            "INSERT INTO related_songs (song_id, related_id, score) VALUES (?, ?, ?)",
+            [(song_id, row['candidate'], row['score']) for row in candidates]
+        )
+
+def songs_referencing(song_id):
+    # 在相关推荐中引用该歌曲的歌曲，其详情缓存中包含该歌曲的标题等字段
+    return [row['song_id'] for row in DB.execute("SELECT song_id FROM related_songs WHERE related_id = ?", (song_id,))]
+
+def forget_related(song_id):
+    DB.execute("DELETE FROM related_songs WHERE song_id = ? OR related_id = ?", (song_id, song_id))
+
+def get_related_songs(song_id, genre):
+    limit = app.config['RELATED_SONGS_SHOWN']
+    related = [dict(row) for row in DB.execute('''
+        SELECT m.id, m.title, m.artist, m.album, m.cover_path
+        FROM related_songs r
+        JOIN music m ON r.related_id = m.id
+        WHERE r.song_id = ?
+        ORDER BY r.score DESC
+        LIMIT ?
+    ''', (song_id, limit))]
+    if len(related) >= limit or genre is None:
+        return related
 
-# 数据库辅助函数
-class DB:
-    @staticmethod
-    def get_connection():
-        conn = sqlite3.connect(app.config['DATABASE'])
-        conn.row_factory = sqlite3.Row
-        return conn
+    # 预计算结果不足时，从同流派中随机取一段连续 id 补齐，避免 ORDER BY RANDOM() 全量排序
+    exclude = {song_id} | {song['id'] for song in related}
+    bounds = DB.execute("SELECT MIN(id) AS low, MAX(id) AS high FROM music WHERE genre = ?", (genre,))[0]
+    if bounds['low'] is None:
+        return related
+    start = random.randint(bounds['low'], bounds['high'])
+    for query, params in (
+        ("SELECT id, title, artist, album, cover_path FROM music "
+         "WHERE genre = ? AND id >= ? AND id != ? ORDER BY id LIMIT ?", (genre, start, song_id, limit + len(exclude))),
+        ("SELECT id, title, artist, album, cover_path FROM music "
+         "WHERE genre = ? AND id < ? AND id != ? ORDER BY id LIMIT ?", (genre, start, song_id, limit + len(exclude)))
+    ):
+        for row in DB.execute(query, params):
+            if len(related) >= limit:
+                return related
+            if row['id'] not in exclude:
+                exclude.add(row['id'])
+                related.append(dict(row))
+    return related
 
-    @staticmethod
-    def execute(query, params=(), commit=False):
-        conn = DB.get_connection()
+# 全文搜索：music_fts 的 rowid 与 music.id 一致
+CJK_PATTERN = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff])')
+SEARCH_WEIGHTS = (10.0, 5.0, 3.0, 1.0, 2.0)
+
+def segment_text(text):
+    # unicode61 会把连续的中文当作一个词，逐字加空格后才能按字词匹配
+    return CJK_PATTERN.sub(r' \1 ', text or '')
+
+def build_match_query(keywords):
+    # 每个关键词按短语匹配；末尾不是中文时追加前缀匹配，用于输入联想
+    terms = []
+    for word in keywords.split():
+        pieces = re.findall(r'\w+', segment_text(word))
+        if not pieces:
+            continue
+        phrase = ' '.join(pieces)
+        terms.append(f'"{phrase}"' if CJK_PATTERN.fullmatch(pieces[-1]) else f'"{phrase}"*')
+    return ' '.join(terms)
+
+def index_song(song_id):
+    if not get_backend().full_text_search:
+        return
+    song = DB.execute("SELECT id, title, artist, album, lyrics, categories FROM music WHERE id = ?", (song_id,))
+    with DB.transaction():
+        DB.execute("DELETE FROM music_fts WHERE rowid = ?", (song_id,))
+        if song:
+            song = song[0]
+            DB.execute(
+                "INSERT INTO music_fts (rowid, title, artist, album, lyrics, categories) VALUES (?, ?, ?, ?, ?, ?)",
+                (song_id, segment_text(song['title']), segment_text(song['artist']),
+                 segment_text(song['album']), segment_text(song['lyrics']),
+                 segment_text(' '.join(song_dict(song)['categories'])))
+            )
+
+def unindex_song(song_id):
+    if not get_backend().full_text_search:
+        return
+    DB.execute("DELETE FROM music_fts WHERE rowid = ?", (song_id,))
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """重建全文搜索索引"""
+    if not get_backend().full_text_search:
+        print('当前数据库后端不使用全文索引')
+        return
+    count = 0
+    for row in DB.execute("SELECT id FROM music"):
+        index_song(row['id'])
+        count += 1
+    print(f'已索引 {count} 首歌曲')
+
+@app.cli.command('rebuild-related')
+def rebuild_related_command():
+    """重新计算所有歌曲的相关歌曲（共同收藏关系变化后定期执行）"""
+    count = 0
+    for row in DB.execute("SELECT id FROM music"):
+        refresh_related(row['id'])
+        count += 1
+    print(f'已更新 {count} 首歌曲的相关歌曲')
+
+# 分类与标签：song_categories 变化后刷新 music.categories / music.tags 并重建搜索索引
+def refresh_song_categories(song_ids):
+    song_ids = list(dict.fromkeys(song_ids))
+    batch_size = app.config['BULK_BATCH_SIZE']
+    for start in range(0, len(song_ids), batch_size):
+        batch = song_ids[start:start + batch_size]
+        names = {song_id: ([], []) for song_id in batch}
+        placeholders = ','.join('?' * len(batch))
+        rows = DB.execute(f'''
+            SELECT sc.song_id, c.name, c.type
+            FROM song_categories sc
+            JOIN categories c ON sc.category_id = c.id
+            WHERE sc.song_id IN ({placeholders})
+            ORDER BY c.id
+        ''', tuple(batch))
+        for row in rows:
+            categories, tags = names[row['song_id']]
+            categories.append(row['name'])
+            if row['type'] == 'tag':
+                tags.append(row['name'])
+        with DB.transaction():
+            DB.executemany(
+                "UPDATE music SET categories = ?, tags = ? WHERE id = ?",
+                [(json.dumps(categories, ensure_ascii=False), json.dumps(tags, ensure_ascii=False), song_id)
+                 for song_id, (categories, tags) in names.items()]
+            )
+            for song_id in batch:
+                index_song(song_id)
+    for song_id in song_ids:
+        invalidate_song_cache(song_id, listing=False)
+    invalidate_song_cache()
+
+def category_song_ids(category_id):
+    return [row['song_id'] for row in DB.execute(
+        "SELECT song_id FROM song_categories WHERE category_id = ?", (category_id,))]
+
+# 写入队列（write-behind）：突发写入时由单个线程批量提交，避免大量请求争抢 SQLite 写锁
+class WriteQueueFull(Exception):
+    pass
+
+class WriteBehindQueue:
+    def __init__(self, size, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue(maxsize=size)
+        self._thread = threading.Thread(target=self._drain, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, fn, args, after=None):
+        future = Future()
         try:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            if commit:
-                conn.commit()
-            if query.strip().upper().startswith('SELECT'):
-                return cursor.fetchall()
-            elif query.strip().upper().startswith('INSERT'):
-                return cursor.lastrowid
-            return True
-        except sqlite3.Error as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            self._queue.put((fn, args, after, future), timeout=app.config['WRITE_BEHIND_PUT_TIMEOUT'])
+        except queue.Full:
+            raise WriteQueueFull()
+        return future
 
-# 装饰器
-def login_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if 'user_id' not in session:
-            return json_response('请先登录', 401)
-        return f(*args, **kwargs)
-    return decorated
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=10)
 
-def admin_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if 'user_id' not in session:
-            return json_response('请先登录', 401)
-        if session.get('role') != 'admin':
-            return json_response('需要管理员权限', 403)
-        return f(*args, **kwargs)
-    return decorated
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            items = []
+            deadline = time.monotonic() + self.interval
+            while item is not None:
+                items.append(item)
+                if len(items) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            if items:
+                self._write(items)
+            if item is None:
+                return
 
-# 响应辅助函数
-def json_response(message=None, status=200, data=None):
-    response = {'success': status == 200}
-    if message:
-        response['message'] = message
-    if data is not None:
-        response['data'] = data
-    return jsonify(response), status
+    def _write(self, items):
+        # 每个写入包在 SAVEPOINT 中，单个失败只回滚自身，不影响同一批次的其他写入
+        outcomes = []
+        try:
+            with DB.transaction():
+                for fn, args, after, future in items:
+                    DB.execute("SAVEPOINT write_behind")
+                    try:
+                        outcomes.append((future, after, fn(*args), None))
+                        DB.execute("RELEASE write_behind")
+                    except Exception as e:
+                        DB.execute("ROLLBACK TO write_behind")
+                        DB.execute("RELEASE write_behind")
+                        outcomes.append((future, None, None, e))
+        except Exception as e:
+            app.logger.error('写入队列提交失败，%d 个写入被丢弃: %s', len(items), e)
+            for *_, future in items:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.writes += len(items)
+        for future, after, result, error in outcomes:
+            if error is not None:
+                app.logger.error('写入队列中的写入失败: %s', error)
+                future.set_exception(error)
+                continue
+            if after is not None:
+                try:
+                    after(result)
+                except Exception as e:
+                    app.logger.error('写入提交后的回调失败: %s', e)
+            future.set_result(result)
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+def write_queue():
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteBehindQueue(app.config['WRITE_BEHIND_QUEUE_SIZE'],
+                                            app.config['WRITE_BEHIND_BATCH_SIZE'],
+                                            app.config['WRITE_BEHIND_INTERVAL'])
+        return _write_queue
+
+@atexit.register
+def flush_write_queue():
+    # 正常退出时提交队列中剩余的写入
+    if _write_queue is not None:
+        _write_queue.close()
+
+# 执行写入并在提交后调用 after(结果)。未开启写入队列时直接执行；
+# 开启时按 WRITE_BEHIND_DURABILITY 等待提交并返回结果，或入队后立即返回 None
+def submit_write(fn, args, after=None):
+    if not app.config['WRITE_BEHIND']:
+        result = fn(*args)
+        if after is not None:
+            after(result)
+        return result
+    future = write_queue().submit(fn, args, after)
+    if app.config['WRITE_BEHIND_DURABILITY'] == 'queued':
+        return None
+    try:
+        return future.result(timeout=app.config['WRITE_BEHIND_COMMIT_TIMEOUT'])
+    except FutureTimeout:
+        # 写入已在队列中，稍后仍会提交；按 queued 返回，客户端重试会造成重复写入
+        return None
+
+@app.errorhandler(WriteQueueFull)
+def write_queue_full(error):
+    resp = json_response('服务繁忙，请稍后重试', 503)
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+# 封面衍生图：cover_variants 形如 {"webp": {"160": "covers/variants/<hash>-160.webp"}}
+_background_executor = None
+_background_executor_lock = threading.Lock()
+
+def background_executor():
+    global _background_executor
+    with _background_executor_lock:
+        if _background_executor is None:
+            _background_executor = ThreadPoolExecutor(max_workers=app.config['BACKGROUND_WORKERS'],
+                                                      thread_name_prefix='background')
+        return _background_executor
+
+def build_cover_variants(song_id, cover_path):
+    relative = resolve_media(cover_path, 'covers')
+    if relative is None:
+        return None
+    source = os.path.join(app.root_path, 'static', relative)
+    with open(source, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+
+    variants_dir = app.config['COVER_VARIANTS_DIR']
+    os.makedirs(os.path.join(app.root_path, 'static', variants_dir), exist_ok=True)
+    Image.init()
+    variants = {}
+    with Image.open(source) as image:
+        image = image.convert('RGB')
+        for fmt in app.config['COVER_FORMATS']:
+            if fmt.upper() not in Image.SAVE:
+                continue
+            for size in app.config['COVER_SIZES']:
+                width = min(size, image.width)
+                name = f'{variants_dir}/{digest}-{width}.{fmt}'
+                target = os.path.join(app.root_path, 'static', name)
+                # 文件名包含内容哈希，已存在即可直接复用
+                if not os.path.exists(target):
+                    resized = image.copy()
+                    resized.thumbnail((width, image.height))
+                    tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+                    resized.save(tmp, format=fmt.upper(), quality=app.config['COVER_QUALITY'])
+                    os.replace(tmp, target)
+                variants.setdefault(fmt, {})[str(size)] = name
+
+    # 生成期间封面可能已被修改，只更新仍指向同一封面的记录
+    DB.execute(
+        "UPDATE music SET cover_variants = ? WHERE id = ? AND cover_path = ?",
+        (json.dumps(variants), song_id, cover_path),
+        commit=True
+    )
+    invalidate_song_cache(song_id)
+    return variants
+
+def schedule_cover_variants(song_id, cover_path):
+    def task():
+        try:
+            build_cover_variants(song_id, cover_path)
+        except Exception:
+            app.logger.exception('生成封面衍生图失败: song_id=%s', song_id)
+    return background_executor().submit(task)
+
+@app.cli.command('build-covers')
+def build_covers_command():
+    """为所有歌曲生成封面衍生图"""
+    count = 0
+    for row in DB.execute("SELECT id, cover_path FROM music"):
+        if build_cover_variants(row['id'], row['cover_path']) is not None:
+            count += 1
+    print(f'已生成 {count} 首歌曲的封面衍生图')
+
+# 音频元数据：解析 MP3/WAV 文件头得到时长（秒）、码率（bps）和采样率
+MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+
+def read_wav_metadata(f, file_size):
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    byte_rate = sample_rate = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt = f.read(chunk_size)
+            _, _, sample_rate, byte_rate = struct.unpack('<HHII', fmt[:12])
+            f.seek(chunk_size % 2, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            # 流式写出的 WAV 可能把 data 长度写成 0 或 0xFFFFFFFF，此时以文件实际大小为准
+            data_size = min(chunk_size, file_size - f.tell()) or file_size - f.tell()
+            return {
+                'duration_seconds': round(data_size / byte_rate, 3),
+                'bitrate': byte_rate * 8,
+                'sample_rate': sample_rate
+            }
+        else:
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+def parse_mp3_header(header):
+    value = struct.unpack('>I', header)[0]
+    if value >> 21 != 0x7FF:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}.get((value >> 19) & 3)
+    layer = {1: 3, 2: 2, 3: 1}.get((value >> 17) & 3)
+    bitrate_index = (value >> 12) & 0xF
+    sample_rate_index = (value >> 10) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    if layer == 1:
+        samples = 384
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+    mono = (value >> 6) & 3 == 3
+    if version == 1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    return {'bitrate': bitrate, 'sample_rate': sample_rate, 'samples': samples, 'side_info': side_info}
+
+def read_mp3_metadata(f, file_size):
+    # 跳过 ID3v2 标签
+    start = 0
+    header = f.read(10)
+    if header[:3] == b'ID3' and len(header) == 10:
+        size = header[6] << 21 | header[7] << 14 | header[8] << 7 | header[9]
+        start = 10 + size + (10 if header[5] & 0x10 else 0)
+    f.seek(start)
+    data = f.read(64 * 1024)
+
+    for offset in range(len(data) - 4):
+        if data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+            continue
+        frame = parse_mp3_header(data[offset:offset + 4])
+        if frame is None:
+            continue
+        audio_bytes = file_size - start - offset
+        f.seek(file_size - 128)
+        if f.read(3) == b'TAG':
+            audio_bytes -= 128
+
+        # VBR 文件在首帧中带有 Xing/Info 或 VBRI 头，记录了总帧数
+        frames = None
+        xing = offset + 4 + frame['side_info']
+        vbri = offset + 4 + 32
+        if data[xing:xing + 4] in (b'Xing', b'Info') and len(data) >= xing + 12:
+            if struct.unpack('>I', data[xing + 4:xing + 8])[0] & 1:
+                frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+        elif data[vbri:vbri + 4] == b'VBRI' and len(data) >= vbri + 18:
+            frames = struct.unpack('>I', data[vbri + 14:vbri + 18])[0]
+
+        if frames:
+            duration = frames * frame['samples'] / frame['sample_rate']
+            bitrate = int(audio_bytes * 8 / duration) if duration else frame['bitrate']
+        else:
+            duration = audio_bytes * 8 / frame['bitrate']
+            bitrate = frame['bitrate']
+        return {
+            'duration_seconds': round(duration, 3),
+            'bitrate': bitrate,
+            'sample_rate': frame['sample_rate']
+        }
+    return None
+
+def read_audio_metadata(path):
+    # 可在子进程中执行：只读文件，不访问数据库
+    try:
+        file_size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            if path.lower().endswith('.wav'):
+                return read_wav_metadata(f, file_size)
+            return read_mp3_metadata(f, file_size)
+    except (OSError, struct.error):
+        return None
+
+def format_duration(seconds):
+    return f'{int(seconds) // 60}:{int(seconds) % 60:02d}'
+
+# 解析期间音频可能已被修改，只更新仍指向同一文件的记录；未填写的 duration 文本用解析出的时长补齐
+AUDIO_METADATA_UPDATE = '''
+    UPDATE music SET duration_seconds = ?, bitrate = ?, sample_rate = ?,
+        duration = COALESCE(NULLIF(duration, ''), ?)
+    WHERE id = ? AND audio_path = ?
+'''
+
+def audio_metadata_params(song_id, audio_path, metadata):
+    return (metadata['duration_seconds'], metadata['bitrate'], metadata['sample_rate'],
+            format_duration(metadata['duration_seconds']), song_id, audio_path)
+
+def ingest_audio(song_id, audio_path):
+    relative = resolve_media(audio_path, 'audio')
+    if relative is None:
+        return None
+    metadata = read_audio_metadata(os.path.join(app.root_path, 'static', relative))
+    if metadata is None:
+        return None
+    DB.execute(AUDIO_METADATA_UPDATE, audio_metadata_params(song_id, audio_path, metadata), commit=True)
+    invalidate_song_cache(song_id)
+    return metadata
+
+def schedule_audio_ingest(song_id, audio_path):
+    def task():
+        try:
+            ingest_audio(song_id, audio_path)
+        except Exception:
+            app.logger.exception('读取音频元数据失败: song_id=%s', song_id)
+    return background_executor().submit(task)
+
+@app.cli.command('scan-audio')
+@click.option('--all', 'rescan', is_flag=True, help='重新扫描已有元数据的歌曲')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='解析文件的进程数')
+@click.option('--batch-size', default=500, show_default=True, help='每个事务更新的行数')
+def scan_audio_command(rescan, workers, batch_size):
+    """批量解析音频文件并回填时长、码率和采样率"""
+    query = "SELECT id, audio_path FROM music"
+    if not rescan:
+        query += " WHERE duration_seconds IS NULL"
+    songs = []
+    for row in DB.execute(query):
+        relative = resolve_media(row['audio_path'], 'audio')
+        if relative is not None:
+            songs.append((row['id'], row['audio_path'], os.path.join(app.root_path, 'static', relative)))
+
+    updated = 0
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        paths = [path for _, _, path in songs]
+        for (song_id, audio_path, _), metadata in zip(songs, pool.map(read_audio_metadata, paths, chunksize=64)):
+            if metadata is None:
+                continue
+            batch.append(audio_metadata_params(song_id, audio_path, metadata))
+            if len(batch) >= batch_size:
+                updated += write_audio_metadata(batch)
+                batch = []
+    if batch:
+        updated += write_audio_metadata(batch)
+
+    invalidate_song_cache()
+    print(f'已更新 {updated} 首歌曲的音频元数据（共扫描 {len(songs)} 个文件）')
+
+def write_audio_metadata(batch):
+    # batch 为 audio_metadata_params 生成的参数，与 ingest_audio 使用同一条 UPDATE
+    with DB.transaction():
+        DB.executemany(AUDIO_METADATA_UPDATE, batch)
+    for params in batch:
+        invalidate_song_cache(params[4], listing=False)
+    return len(batch)
 
 # 初始化数据库
 def init_db():
     with app.app_context():
-        # 创建表结构
-        tables = [
-            '''
-            CREATE TABLE IF NOT EXISTS music (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                artist TEXT NOT NULL,
-                album TEXT,
-                duration TEXT,
-                cover_path TEXT,
-                audio_path TEXT,
-                genre TEXT,
-                release_date TEXT,
-                lyrics TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            ''',
-            '''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                email TEXT,
-                role TEXT DEFAULT 'user',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            ''',
-            '''
-            CREATE TABLE IF NOT EXISTS comments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                song_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (song_id) REFERENCES music (id),
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-            ''',
-            '''
-            CREATE TABLE IF NOT EXISTS favorites (
-                user_id INTEGER NOT NULL,
-                song_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, song_id),
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (song_id) REFERENCES music (id)
-            )
-            ''',
-            '''
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                description TEXT,
-                type TEXT DEFAULT 'category',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            ''',
-            '''
-            CREATE TABLE IF NOT EXISTS song_categories (
-                song_id INTEGER NOT NULL,
-                category_id INTEGER NOT NULL,
-                PRIMARY KEY (song_id, category_id),
-                FOREIGN KEY (song_id) REFERENCES music (id),
-                FOREIGN KEY (category_id) REFERENCES categories (id)
-            )
-            '''
-        ]
-
-        for table in tables:
-            DB.execute(table, commit=True)
+        migrate()
 
         # 添加默认管理员
         admin = DB.execute("SELECT id FROM users WHERE username = ?", (app.config['DEFAULT_ADMIN']['username'],))
         if not admin:
-            hashed_pw = generate_password_hash(app.config['DEFAULT_ADMIN']['password'])
+            hashed_pw = hash_password(app.config['DEFAULT_ADMIN']['password'])
             DB.execute(
                 "INSERT INTO users (username, password, email, role) VALUES (?, ?, ?, ?)",
                 (app.config['DEFAULT_ADMIN']['username'], hashed_pw,
@@ -180,16 +2805,28 @@ def login():
     if not username or not password:
         return json_response('用户名和密码不能为空', 400)
 
-    user = DB.execute("SELECT id, username, password, role FROM users WHERE username = ?", (username,))
-    if not user or not check_password_hash(user[0]['password'], password):
+    # 在计算哈希之前检查限流；只有失败的尝试计数，同一 IP 上其他用户的正常登录不受影响，
+    # 他人也无法从别的 IP 锁定某个账号
+    limiter = login_limiter()
+    keys = (f'user:{username}:{request.remote_addr}', f'ip:{request.remote_addr}')
+    wait = max(limiter.wait(key) for key in keys)
+    if wait:
+        resp = json_response('登录尝试过于频繁，请稍后再试', 429)
+        resp.headers['Retry-After'] = str(int(wait) + 1)
+        return resp
+
+    user = DB.execute("SELECT id, username, password, role FROM users WHERE username = ?", (username,),
+                      primary=True)
+    valid, needs_rehash = verify_password(user[0]['password'], password) if user else (False, False)
+    if not valid:
+        for key in keys:
+            limiter.charge(key)
         return json_response('用户名或密码错误', 401)
 
     user = user[0]
-    session.update({
-        'user_id': user['id'],
-        'username': user['username'],
-        'role': user['role']
-    })
+    if needs_rehash:
+        DB.execute("UPDATE users SET password = ? WHERE id = ?", (hash_password(password), user['id']), commit=True)
+    start_session(user['id'])
 
     return json_response('登录成功', data={
         'id': user['id'],
@@ -212,25 +2849,21 @@ def register():
         return json_response('两次输入的密码不一致', 400)
 
     try:
-        hashed_pw = generate_password_hash(password)
+        hashed_pw = hash_password(password)
         user_id = DB.execute(
-            "INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
+            "INSERT INTO users (username, password, email) VALUES (?, ?, ?) RETURNING id",
             (username, hashed_pw, email),
             commit=True
         )
 
-        session.update({
-            'user_id': user_id,
-            'username': username,
-            'role': 'user'
-        })
+        start_session(user_id)
 
         return json_response('注册成功', 201, {
             'id': user_id,
             'username': username,
             'role': 'user'
         })
-    except sqlite3.IntegrityError:
+    except IntegrityError:
         return json_response('用户名已存在', 400)
     except Exception as e:
         return json_response(str(e), 500)
@@ -242,92 +2875,340 @@ def logout():
 
 @app.route('/api/auth/me', methods=['GET'])
 def current_user_info():
-    if 'user_id' not in session:
+    if g.user is None:
         return json_response('未登录', 401)
 
-    return json_response(data={
-        'id': session['user_id'],
-        'username': session['username'],
-        'role': session['role']
-    })
+    return json_response(data=g.user)
 
 # 音乐相关路由
 @app.route('/api/songs', methods=['GET'])
 def get_songs():
-    songs = DB.execute('''
-        SELECT m.*, GROUP_CONCAT(c.name) as categories,
-        GROUP_CONCAT(CASE WHEN c.type = 'tag' THEN c.name ELSE NULL END) as tags
-        FROM music m
-        LEFT JOIN song_categories sc ON m.id = sc.song_id
-        LEFT JOIN categories c ON sc.category_id = c.id
-        GROUP BY m.id
-        ORDER BY m.created_at DESC
-    ''')
+    cache_key = songs_cache_key()
+    etag = personal_etag(catalog_etag(cache_key, SONGS_VERSION_SCOPE))
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+
+    cached = get_cache().get(cache_key)
+    if cached is not None:
+        return json_response(data=dict(cached, songs=mark_favorites(cached['songs'])), etag=etag)
+
+    limit = page_limit(app.config['SONGS_PAGE_SIZE'], app.config['SONGS_MAX_PAGE_SIZE'])
+    if limit is None:
+        return json_response('limit 参数无效', 400)
 
-    songs_data = []
-    for song in songs:
-        song_data = dict(song)
-        song_data['categories'] = song['categories'].split(',') if song['categories'] else []
-        song_data['tags'] = song['tags'].split(',') if song['tags'] else []
-        songs_data.append(song_data)
+    fields = SONG_LIST_FIELDS
+    requested = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    unknown = [f for f in requested if f not in SONG_FIELDS]
+    if unknown:
+        return json_response(f"未知字段: {', '.join(unknown)}", 400)
+    sort = request.args.get('sort', '-created_at')
+    if sort not in SONG_SORTS:
+        return json_response('sort 参数无效', 400)
+    sort_column, descending = SONG_SORTS[sort]
 
-    return json_response(data=songs_data)
+    if request.args.get('fields'):
+        # 游标依赖 id 和排序列，始终返回
+        fields = tuple(dict.fromkeys(['id', sort_column] + requested))
+
+    source = 'music m'
+    conditions = []
+    params = []
+    if sort_column != 'created_at':
+        conditions.append(f'm.{sort_column} IS NOT NULL')
+    # 不按时长排序时，时长范围只作为过滤条件（一元 + 使其不走时长索引），
+    # 否则会先取出整个时长范围再临时排序
+    duration = 'm.duration_seconds' if sort_column == 'duration_seconds' else '+m.duration_seconds'
+    for arg, operator in (('min_duration', '>='), ('max_duration', '<=')):
+        if request.args.get(arg):
+            try:
+                params.append(float(request.args[arg]))
+            except ValueError:
+                return json_response(f'{arg} 参数无效', 400)
+            conditions.append(f'{duration} {operator} ?')
+    for column in ('genre', 'artist'):
+        if request.args.get(column):
+            conditions.append(f'm.{column} = ?')
+            params.append(request.args[column])
+    if request.args.get('category'):
+        # 从该分类的歌曲集合出发（idx_song_categories_category），冷门分类不必遍历整个曲库的排序索引；
+        # CROSS JOIN 固定连接顺序，排序只涉及该分类下的歌曲
+        source = 'song_categories sc CROSS JOIN music m'
+        conditions.append('sc.category_id = (SELECT id FROM categories WHERE name = ?) AND m.id = sc.song_id')
+        params.append(request.args['category'])
+    if request.args.get('cursor'):
+        cursor = decode_cursor(request.args['cursor'])
+        if cursor is None:
+            return json_response('分页游标无效', 400)
+        conditions.append(f"(m.{sort_column}, m.id) {'<' if descending else '>'} (?, ?)")
+        params.extend(cursor)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    columns = ', '.join(f'm.{f}' for f in fields)
+    direction = 'DESC' if descending else 'ASC'
+    # 多取一条用于判断是否还有下一页
+    songs = DB.execute(f'''
+        SELECT {columns}
+        FROM {source}
+        {where}
+        ORDER BY m.{sort_column} {direction}, m.id {direction}
+        LIMIT ?
+    ''', (*params, limit + 1))
+
+    songs_data = [song_dict(song) for song in songs[:limit]]
+    next_cursor = None
+    if len(songs) > limit:
+        last = songs_data[-1]
+        next_cursor = encode_cursor(last[sort_column], last['id'])
+
+    result = {'songs': songs_data, 'next_cursor': next_cursor}
+    get_cache().set(cache_key, result)
+    return json_response(data=dict(result, songs=mark_favorites(songs_data)), etag=etag)
 
 @app.route('/api/songs/<int:song_id>', methods=['GET'])
 def get_song(song_id):
-    song = DB.execute('''
-        SELECT m.*, GROUP_CONCAT(c.name) as categories,
-        GROUP_CONCAT(CASE WHEN c.type = 'tag' THEN c.name ELSE NULL END) as tags
-        FROM music m
-        LEFT JOIN song_categories sc ON m.id = sc.song_id
-        LEFT JOIN categories c ON sc.category_id = c.id
-        WHERE m.id = ?
-        GROUP BY m.id
-    ''', (song_id,))
+    cache_key = song_cache_key(song_id)
+    result = get_cache().get(cache_key)
+    if result is None:
+        song = DB.execute("SELECT * FROM music WHERE id = ?", (song_id,))
+
+        if not song:
+            return json_response('歌曲不存在', 404)
+
+        song_data = song_dict(song[0])
+
+        related = get_related_songs(song_id, song_data['genre'])
 
+        # 相关推荐不足时随机补齐，每次重建的内容可能不同，因此 ETag 由内容计算并随缓存保存
+        digest = hashlib.sha1(json.dumps([song_data, related], sort_keys=True, default=str).encode()).hexdigest()
+        result = {
+            'song': song_data,
+            'related_songs': related,
+            'etag': digest[:16]
+        }
+        get_cache().set(cache_key, result)
+
+    etag = personal_etag(result['etag'])
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+    return json_response(data=mark_song_detail(result), etag=etag)
+
+# 歌曲与相关推荐一次查询完成收藏标记
+def mark_song_detail(result):
+    songs = mark_favorites([result['song'], *result['related_songs']])
+    return {'song': songs[0], 'related_songs': songs[1:]}
+
+@app.route('/api/songs/<int:song_id>/comments', methods=['GET'])
+def get_song_comments(song_id):
+    limit = page_limit(app.config['COMMENTS_PAGE_SIZE'], app.config['COMMENTS_MAX_PAGE_SIZE'])
+    if limit is None:
+        return json_response('limit 参数无效', 400)
+
+    song = DB.execute("SELECT id, comment_count FROM music WHERE id = ?", (song_id,))
     if not song:
         return json_response('歌曲不存在', 404)
 
-    song = song[0]
-    song_data = dict(song)
-    song_data['categories'] = song['categories'].split(',') if song['categories'] else []
-    song_data['tags'] = song['tags'].split(',') if song['tags'] else []
+    conditions = ['c.song_id = ?']
+    params = [song_id]
+    if request.args.get('cursor'):
+        cursor = decode_cursor(request.args['cursor'])
+        if cursor is None:
+            return json_response('分页游标无效', 400)
+        conditions.append('(c.created_at, c.id) < (?, ?)')
+        params.extend(cursor)
 
-    related = DB.execute('''
-        SELECT id, title, artist, album, cover_path
-        FROM music
-        WHERE genre = ? AND id != ?
-        ORDER BY RANDOM()
-        LIMIT 3
-    ''', (song_data['genre'], song_id))
-
-    comments = DB.execute('''
+    comments = DB.execute(f'''
         SELECT c.*, u.username
         FROM comments c
         JOIN users u ON c.user_id = u.id
-        WHERE c.song_id = ?
-        ORDER BY c.created_at DESC
-    ''', (song_id,))
+        WHERE {' AND '.join(conditions)}
+        ORDER BY c.created_at DESC, c.id DESC
+        LIMIT ?
+    ''', (*params, limit + 1))
+
+    comments_data = [dict(c) for c in comments[:limit]]
+    next_cursor = None
+    if len(comments) > limit:
+        last = comments_data[-1]
+        next_cursor = encode_cursor(last['created_at'], last['id'])
 
     return json_response(data={
-        'song': song_data,
-        'related_songs': [dict(s) for s in related],
-        'comments': [dict(c) for c in comments]
+        'comments': comments_data,
+        'comment_count': song[0]['comment_count'],
+        'next_cursor': next_cursor
     })
 
+@app.route('/api/search', methods=['GET'])
+def search_songs():
+    match = build_match_query(request.args.get('q', ''))
+    if not match:
+        return json_response('请输入搜索关键词', 400)
+    limit = page_limit(app.config['SEARCH_PAGE_SIZE'], app.config['SEARCH_MAX_PAGE_SIZE'])
+    if limit is None:
+        return json_response('limit 参数无效', 400)
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return json_response('offset 参数无效', 400)
+
+    columns = ', '.join(f'm.{f}' for f in SONG_LIST_FIELDS)
+    if not get_backend().full_text_search:
+        songs = search_songs_like(request.args.get('q', ''), columns, limit, offset)
+        return json_response(data={'songs': mark_favorites([song_dict(song) for song in songs])})
+    weights = ', '.join(str(w) for w in SEARCH_WEIGHTS)
+    songs = DB.execute(f'''
+        SELECT {columns}
+        FROM (
+            SELECT rowid, bm25(music_fts, {weights}) AS score
+            FROM music_fts
+            WHERE music_fts MATCH ?
+            ORDER BY score
+            LIMIT ? OFFSET ?
+        ) hits
+        JOIN music m ON m.id = hits.rowid
+        ORDER BY hits.score
+    ''', (match, limit, offset))
+
+    return json_response(data={'songs': mark_favorites([song_dict(song) for song in songs])})
+
+def search_songs_like(keywords, columns, limit, offset):
+    # 没有全文索引的后端：每个关键词需出现在标题、歌手或专辑中，按热度排序
+    conditions = []
+    params = []
+    for word in keywords.split():
+        pattern = '%' + word.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append(
+            "(LOWER(m.title) LIKE ? ESCAPE '\\' OR LOWER(m.artist) LIKE ? ESCAPE '\\' "
+            "OR LOWER(m.album) LIKE ? ESCAPE '\\')"
+        )
+        params.extend([pattern] * 3)
+    return DB.execute(f'''
+        SELECT {columns}
+        FROM music m
+        WHERE {' AND '.join(conditions)}
+        ORDER BY m.favorite_count DESC, m.id
+        LIMIT ? OFFSET ?
+    ''', (*params, limit, offset))
+
+# 媒体路径相对于 static 目录，兼容只存文件名的旧数据（如 'song11.mp3' 位于 static/audio）
+def resolve_media(path, subdir):
+    if not path:
+        return None
+    static_dir = os.path.join(app.root_path, 'static')
+    for relative in (path, f'{subdir}/{path}'):
+        full = safe_join(static_dir, relative)
+        if full and os.path.isfile(full):
+            return relative
+    return None
+
+# 分片上传完成后的文件以 SHA-256 前缀命名，同一路径的内容不会变化
+CONTENT_HASHED_NAME = re.compile(r'[0-9a-f]{32}\.\w+')
+
+def is_content_hashed_upload(relative):
+    upload_prefix = os.path.relpath(upload_dir(), os.path.join(app.root_path, 'static')).replace(os.sep, '/') + '/'
+    return (relative.startswith(upload_prefix)
+            and CONTENT_HASHED_NAME.fullmatch(relative[len(upload_prefix):]) is not None)
+
+@app.route('/api/songs/<int:song_id>/stream', methods=['GET'])
+def stream_song(song_id):
+    song = DB.execute("SELECT audio_path FROM music WHERE id = ?", (song_id,))
+    if not song:
+        return json_response('歌曲不存在', 404)
+
+    relative = resolve_media(song[0]['audio_path'], 'audio')
+    if relative is None:
+        return json_response('音频文件不存在', 404)
+
+    prefix = app.config['MEDIA_ACCEL_REDIRECT_PREFIX']
+    if prefix:
+        # 交给 nginx 发送文件，Range 与缓存头由 nginx 处理
+        resp = app.response_class(mimetype=mimetypes.guess_type(relative)[0] or 'application/octet-stream')
+        resp.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative
+        return resp
+
+    # conditional=True 时 send_file 处理 Range/If-Range/If-None-Match，文件经 wsgi.file_wrapper 发送；
+    # ETag 随文件修改时间和大小变化，原地替换的文件在重新验证时会返回新内容
+    hashed = is_content_hashed_upload(relative)
+    resp = send_file(
+        os.path.join(app.root_path, 'static', relative),
+        conditional=True,
+        max_age=app.config['MEDIA_MAX_AGE'] if hashed else app.config['MEDIA_REVALIDATE_MAX_AGE']
+    )
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.cache_control.public = True
+    if hashed:
+        resp.cache_control.immutable = True
+    return resp
+
+# 分类与标签
+CATEGORY_TYPES = ('category', 'tag')
+
+@app.route('/api/categories', methods=['GET'])
+def get_categories():
+    conditions, params = [], []
+    if request.args.get('type'):
+        if request.args['type'] not in CATEGORY_TYPES:
+            return json_response('type 参数无效', 400)
+        conditions.append('c.type = ?')
+        params.append(request.args['type'])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    categories = DB.execute(f'''
+        SELECT c.id, c.name, c.description, c.type,
+               (SELECT COUNT(*) FROM song_categories sc WHERE sc.category_id = c.id) AS song_count
+        FROM categories c
+        {where}
+        ORDER BY c.type, c.name
+    ''', tuple(params))
+    return json_response(data=[dict(category) for category in categories])
+
 # 收藏相关路由
 @app.route('/api/favorites', methods=['GET'])
 @login_required
 def get_favorites():
-    favorites = DB.execute('''
-        SELECT m.*
+    columns = ', '.join(f'm.{f}' for f in SONG_LIST_FIELDS)
+    favorites = DB.execute(f'''
+        SELECT {columns}
         FROM favorites f
         JOIN music m ON f.song_id = m.id
         WHERE f.user_id = ?
         ORDER BY f.created_at DESC
     ''', (session['user_id'],))
 
-    return json_response(data=[dict(song) for song in favorites])
+    return json_response(data=[dict(song_dict(song), is_favorite=True) for song in favorites])
+
+# 收藏与 favorite_count、favorite_buckets 在同一事务中更新；返回是否真正发生了变化
+def add_favorite(user_id, song_id):
+    with DB.transaction():
+        inserted = DB.execute(
+            "INSERT INTO favorites (user_id, song_id) VALUES (?, ?) ON CONFLICT DO NOTHING RETURNING song_id",
+            (user_id, song_id)
+        )
+        if inserted is None:
+            return False
+        DB.execute("UPDATE music SET favorite_count = favorite_count + 1 WHERE id = ?", (song_id,))
+        DB.execute('''
+            INSERT INTO favorite_buckets (day, song_id, count)
+            SELECT SUBSTR(created_at, 1, 10), song_id, 1 FROM favorites WHERE user_id = ? AND song_id = ?
+            ON CONFLICT (day, song_id) DO UPDATE SET count = favorite_buckets.count + 1
+        ''', (user_id, song_id))
+    return True
+
+def remove_favorite(user_id, song_id):
+    with DB.transaction():
+        favorite = DB.execute(
+            "SELECT SUBSTR(created_at, 1, 10) AS day FROM favorites WHERE user_id = ? AND song_id = ?",
+            (user_id, song_id)
+        )
+        if not favorite:
+            return False
+        DB.execute("DELETE FROM favorites WHERE user_id = ? AND song_id = ?", (user_id, song_id))
+        DB.execute("UPDATE music SET favorite_count = favorite_count - 1 WHERE id = ?", (song_id,))
+        DB.execute(
+            "UPDATE favorite_buckets SET count = count - 1 WHERE day = ? AND song_id = ?",
+            (favorite[0]['day'], song_id)
+        )
+    return True
 
 @app.route('/api/favorites/<int:song_id>', methods=['POST', 'DELETE'])
 @login_required
@@ -336,24 +3217,105 @@ def toggle_favorite(song_id):
     if not song:
         return json_response('歌曲不存在', 404)
 
-    if request.method == 'POST':
-        try:
-            DB.execute(
-                "INSERT INTO favorites (user_id, song_id) VALUES (?, ?)",
-                (session['user_id'], song_id),
-                commit=True
-            )
-            return json_response(data={'isFavorite': True})
-        except sqlite3.IntegrityError:
-            return json_response(data={'isFavorite': True})
+    user_id = session['user_id']
 
-    elif request.method == 'DELETE':
-        DB.execute(
-            "DELETE FROM favorites WHERE user_id = ? AND song_id = ?",
-            (session['user_id'], song_id),
-            commit=True
-        )
-        return json_response(data={'isFavorite': False})
+    def favorite_written(changed):
+        if changed:
+            invalidate_song_cache(song_id, listing=False)
+            favorites_version(user_id, bump=True)
+
+    is_favorite = request.method == 'POST'
+    changed = submit_write(add_favorite if is_favorite else remove_favorite, (user_id, song_id), favorite_written)
+    data = {'isFavorite': is_favorite}
+    if changed is None:
+        data['queued'] = True
+    return json_response(data=data)
+
+@app.route('/api/favorites/batch', methods=['POST'])
+@login_required
+def batch_favorites():
+    data = request.get_json(silent=True) or {}
+    add_ids = data.get('add', [])
+    remove_ids = data.get('remove', [])
+    if not isinstance(add_ids, list) or not isinstance(remove_ids, list):
+        return json_response('add 和 remove 必须是歌曲 ID 列表', 400)
+    if any(not isinstance(i, int) or isinstance(i, bool) for i in add_ids + remove_ids):
+        return json_response('歌曲 ID 必须是整数', 400)
+    add_ids = list(dict.fromkeys(add_ids))
+    remove_ids = [i for i in dict.fromkeys(remove_ids) if i not in add_ids]
+    if not add_ids and not remove_ids:
+        return json_response('请提供要收藏或取消收藏的歌曲', 400)
+    if len(add_ids) + len(remove_ids) > app.config['FAVORITES_BATCH_MAX']:
+        return json_response(f"单次最多处理 {app.config['FAVORITES_BATCH_MAX']} 首歌曲", 400)
+
+    user_id = session['user_id']
+    added, removed = [], []
+    with DB.transaction():
+        existing = set()
+        if add_ids:
+            placeholders = ','.join('?' * len(add_ids))
+            existing = {row['id'] for row in DB.execute(
+                f"SELECT id FROM music WHERE id IN ({placeholders})", tuple(add_ids))}
+        missing = [i for i in add_ids if i not in existing]
+        for song_id in add_ids:
+            if song_id in existing and add_favorite(user_id, song_id):
+                added.append(song_id)
+        for song_id in remove_ids:
+            if remove_favorite(user_id, song_id):
+                removed.append(song_id)
+
+    for song_id in added + removed:
+        invalidate_song_cache(song_id, listing=False)
+    if added or removed:
+        favorites_version(user_id, bump=True)
+    return json_response(data={'added': added, 'removed': removed, 'missing': missing})
+
+# 排行榜
+CHART_WINDOWS = {'day': 0, 'week': 6}
+
+@app.route('/api/charts/favorites', methods=['GET'])
+def favorites_chart():
+    window = request.args.get('window', 'all')
+    if window != 'all' and window not in CHART_WINDOWS:
+        return json_response('window 参数无效', 400)
+    limit = page_limit(app.config['CHARTS_SIZE'], app.config['CHARTS_SIZE'])
+    if limit is None:
+        return json_response('limit 参数无效', 400)
+
+    cache_key = f'charts:favorites:{window}:{limit}'
+    cached = get_cache().get(cache_key)
+    if cached is not None:
+        return json_response(data=cached)
+
+    columns = 'm.id, m.title, m.artist, m.album, m.cover_path, m.cover_variants, m.favorite_count'
+    if window == 'all':
+        songs = DB.execute(f'''
+            SELECT {columns}, m.favorite_count AS window_count
+            FROM music m
+            WHERE m.favorite_count > 0
+            ORDER BY m.favorite_count DESC, m.id DESC
+            LIMIT ?
+        ''', (limit,))
+    else:
+        since = (datetime.now(timezone.utc).date() - timedelta(days=CHART_WINDOWS[window])).isoformat()
+        songs = DB.execute(f'''
+            SELECT {columns}, b.window_count
+            FROM (
+                SELECT song_id, SUM(count) AS window_count
+                FROM favorite_buckets
+                WHERE day >= ?
+                GROUP BY song_id
+                HAVING SUM(count) > 0
+                ORDER BY window_count DESC, song_id DESC
+                LIMIT ?
+            ) b
+            JOIN music m ON m.id = b.song_id
+            ORDER BY b.window_count DESC, m.id DESC
+        ''', (since, limit))
+
+    result = {'window': window, 'songs': [song_dict(song) for song in songs]}
+    get_cache().set(cache_key, result, ttl=app.config['CHARTS_CACHE_TTL'])
+    return json_response(data=result)
 
 # 评论相关路由
 @app.route('/api/comments', methods=['POST'])
@@ -367,11 +3329,23 @@ def add_comment():
         return json_response('缺少必要参数', 400)
 
     try:
+        new_comment = submit_write(create_comment, (song_id, session['user_id'], content),
+                                   lambda comment: invalidate_song_cache(song_id, listing=False))
+    except WriteQueueFull:
+        raise
+    except Exception as e:
+        return json_response(str(e), 500)
+    if new_comment is None:
+        return json_response('评论已提交', 202, {'queued': True})
+    return json_response('评论发表成功', 201, new_comment)
+
+def create_comment(song_id, user_id, content):
+    with DB.transaction():
         comment_id = DB.execute(
-            "INSERT INTO comments (song_id, user_id, content) VALUES (?, ?, ?)",
-            (song_id, session['user_id'], content),
-            commit=True
+            "INSERT INTO comments (song_id, user_id, content) VALUES (?, ?, ?) RETURNING id",
+            (song_id, user_id, content)
         )
+        DB.execute("UPDATE music SET comment_count = comment_count + 1 WHERE id = ?", (song_id,))
 
         new_comment = DB.execute('''
             SELECT c.*, u.username
@@ -379,10 +3353,7 @@ def add_comment():
             JOIN users u ON c.user_id = u.id
             WHERE c.id = ?
         ''', (comment_id,))[0]
-
-        return json_response('评论发表成功', 201, dict(new_comment))
-    except Exception as e:
-        return json_response(str(e), 500)
+    return dict(new_comment)
 
 @app.route('/api/comments/<int:comment_id>', methods=['DELETE'])
 @login_required
@@ -392,10 +3363,17 @@ def delete_comment(comment_id):
         return json_response('评论不存在', 404)
 
     comment = comment[0]
-    if session['role'] != 'admin' and comment['user_id'] != session['user_id']:
+    if g.user['role'] != 'admin' and comment['user_id'] != g.user['id']:
         return json_response('无权删除此评论', 403)
 
-    DB.execute("DELETE FROM comments WHERE id = ?", (comment_id,), commit=True)
+    # 以 DELETE 的结果为准：并发删除同一条评论时只有一个请求真正删除并减少计数
+    with DB.transaction():
+        song_id = DB.execute("DELETE FROM comments WHERE id = ? RETURNING song_id", (comment_id,))
+        if song_id is not None:
+            DB.execute("UPDATE music SET comment_count = comment_count - 1 WHERE id = ?", (song_id,))
+    if song_id is None:
+        return json_response('评论不存在', 404)
+    invalidate_song_cache(song_id, listing=False)
     return json_response('评论已删除')
 
 # 管理员路由
@@ -404,14 +3382,11 @@ def delete_comment(comment_id):
 def manage_songs():
     if request.method == 'GET':
         songs = DB.execute("SELECT * FROM music ORDER BY created_at DESC")
-        return json_response(data=[dict(song) for song in songs])
+        return json_response(data=[song_dict(song) for song in songs])
 
     elif request.method == 'POST':
         data = request.get_json()
-        required = ['title', 'artist', 'album', 'duration', 'cover_path',
-                   'audio_path', 'genre', 'release_date', 'lyrics']
-
-        if not all(field in data for field in required):
+        if not all(field in data for field in SONG_REQUIRED_FIELDS):
             return json_response('缺少必要字段', 400)
 
         try:
@@ -421,6 +3396,7 @@ def manage_songs():
                     title, artist, album, duration, cover_path,
                     audio_path, genre, release_date, lyrics
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
                 ''',
                 (
                     data['title'], data['artist'], data['album'], data['duration'],
@@ -429,6 +3405,10 @@ def manage_songs():
                 ),
                 commit=True
             )
+            index_song(song_id)
+            invalidate_song_cache()
+            schedule_cover_variants(song_id, data['cover_path'])
+            schedule_audio_ingest(song_id, data['audio_path'])
             return json_response('歌曲添加成功', 201, {'id': song_id})
         except Exception as e:
             return json_response(str(e), 500)
@@ -442,10 +3422,7 @@ def manage_song(song_id):
 
     if request.method == 'PUT':
         data = request.get_json()
-        required = ['title', 'artist', 'album', 'duration', 'cover_path',
-                   'audio_path', 'genre', 'release_date', 'lyrics']
-
-        if not all(field in data for field in required):
+        if not all(field in data for field in SONG_REQUIRED_FIELDS):
             return json_response('缺少必要字段', 400)
 
         try:
@@ -453,37 +3430,504 @@ def manage_song(song_id):
                 '''
                 UPDATE music SET
                     title = ?, artist = ?, album = ?, duration = ?,
+                    cover_variants = CASE WHEN cover_path = ? THEN cover_variants END,
+                    duration_seconds = CASE WHEN audio_path = ? THEN duration_seconds END,
+                    bitrate = CASE WHEN audio_path = ? THEN bitrate END,
+                    sample_rate = CASE WHEN audio_path = ? THEN sample_rate END,
                     cover_path = ?, audio_path = ?, genre = ?,
                     release_date = ?, lyrics = ?
                 WHERE id = ?
                 ''',
                 (
                     data['title'], data['artist'], data['album'], data['duration'],
+                    data['cover_path'], data['audio_path'], data['audio_path'], data['audio_path'],
                     data['cover_path'], data['audio_path'], data['genre'],
                     data['release_date'], data['lyrics'], song_id
                 ),
                 commit=True
             )
+            index_song(song_id)
+            invalidate_song_cache(song_id)
+            for referencing_id in songs_referencing(song_id):
+                invalidate_song_cache(referencing_id, listing=False)
+            schedule_cover_variants(song_id, data['cover_path'])
+            schedule_audio_ingest(song_id, data['audio_path'])
             return json_response('歌曲更新成功')
         except Exception as e:
             return json_response(str(e), 500)
 
     elif request.method == 'DELETE':
         try:
-            DB.execute("DELETE FROM favorites WHERE song_id = ?", (song_id,), commit=True)
-            DB.execute("DELETE FROM comments WHERE song_id = ?", (song_id,), commit=True)
-            DB.execute("DELETE FROM song_categories WHERE song_id = ?", (song_id,), commit=True)
-            DB.execute("DELETE FROM music WHERE id = ?", (song_id,), commit=True)
+            referencing = songs_referencing(song_id)
+            with DB.transaction():
+                DB.execute("DELETE FROM favorites WHERE song_id = ?", (song_id,))
+                DB.execute("DELETE FROM favorite_buckets WHERE song_id = ?", (song_id,))
+                DB.execute("DELETE FROM comments WHERE song_id = ?", (song_id,))
+                DB.execute("DELETE FROM song_categories WHERE song_id = ?", (song_id,))
+                DB.execute("DELETE FROM music WHERE id = ?", (song_id,))
+                forget_related(song_id)
+                unindex_song(song_id)
+            invalidate_song_cache(song_id)
+            for referencing_id in referencing:
+                invalidate_song_cache(referencing_id, listing=False)
             return json_response('歌曲删除成功')
         except Exception as e:
             return json_response(str(e), 500)
 
+def category_payload(data):
+    name = str(data.get('name', '')).strip()
+    category_type = data.get('type', 'category')
+    if not name:
+        return None, '分类名称不能为空'
+    if category_type not in CATEGORY_TYPES:
+        return None, 'type 必须是 category 或 tag'
+    return (name, data.get('description'), category_type), None
+
+@app.route('/api/admin/categories', methods=['POST'])
+@admin_required
+def create_category():
+    payload, error = category_payload(request.get_json() or {})
+    if error:
+        return json_response(error, 400)
+    try:
+        category_id = DB.execute(
+            "INSERT INTO categories (name, description, type) VALUES (?, ?, ?) RETURNING id", payload, commit=True)
+    except IntegrityError:
+        return json_response('分类名称已存在', 409)
+    return json_response('分类添加成功', 201, {'id': category_id})
+
+@app.route('/api/admin/categories/<int:category_id>', methods=['PUT', 'DELETE'])
+@admin_required
+def manage_category(category_id):
+    category = DB.execute("SELECT id FROM categories WHERE id = ?", (category_id,))
+    if not category:
+        return json_response('分类不存在', 404)
+
+    if request.method == 'PUT':
+        payload, error = category_payload(request.get_json() or {})
+        if error:
+            return json_response(error, 400)
+        try:
+            DB.execute("UPDATE categories SET name = ?, description = ?, type = ? WHERE id = ?",
+                       (*payload, category_id), commit=True)
+        except IntegrityError:
+            return json_response('分类名称已存在', 409)
+        refresh_song_categories(category_song_ids(category_id))
+        return json_response('分类更新成功')
+
+    elif request.method == 'DELETE':
+        song_ids = category_song_ids(category_id)
+        with DB.transaction():
+            DB.execute("DELETE FROM song_categories WHERE category_id = ?", (category_id,))
+            DB.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+        refresh_song_categories(song_ids)
+        return json_response('分类删除成功')
+
+# 批量为歌曲添加或移除分类：{"song_ids": [...]}
+@app.route('/api/admin/categories/<int:category_id>/songs', methods=['POST', 'DELETE'])
+@admin_required
+def assign_category(category_id):
+    category = DB.execute("SELECT id FROM categories WHERE id = ?", (category_id,))
+    if not category:
+        return json_response('分类不存在', 404)
+    song_ids = (request.get_json(silent=True) or {}).get('song_ids')
+    if not isinstance(song_ids, list) or not song_ids:
+        return json_response('song_ids 必须是非空的歌曲 ID 列表', 400)
+    if any(not isinstance(i, int) or isinstance(i, bool) for i in song_ids):
+        return json_response('歌曲 ID 必须是整数', 400)
+    if len(song_ids) > app.config['CATEGORY_BATCH_MAX']:
+        return json_response(f"单次最多处理 {app.config['CATEGORY_BATCH_MAX']} 首歌曲", 400)
+
+    song_ids = list(dict.fromkeys(song_ids))
+    placeholders = ','.join('?' * len(song_ids))
+    existing = {row['id'] for row in DB.execute(
+        f"SELECT id FROM music WHERE id IN ({placeholders})", tuple(song_ids))}
+    missing = [i for i in song_ids if i not in existing]
+    song_ids = [i for i in song_ids if i in existing]
+
+    with DB.transaction():
+        if request.method == 'POST':
+            changed = DB.executemany(
+                "INSERT INTO song_categories (song_id, category_id) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                [(song_id, category_id) for song_id in song_ids])
+        else:
+            changed = DB.executemany(
+                "DELETE FROM song_categories WHERE song_id = ? AND category_id = ?",
+                [(song_id, category_id) for song_id in song_ids])
+    if changed:
+        refresh_song_categories(song_ids)
+    return json_response(data={'changed': changed, 'missing': missing})
+
+# 分片上传：先创建上传会话，再按顺序 PUT 分片（Content-Range），可通过 GET 查询已接收字节数后续传
+# 已接收的字节数以磁盘上的临时文件大小为准；完成后按 SHA-256 校验并以内容哈希命名去重
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+
+def upload_dir():
+    return os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+
+def partial_upload_path(upload_id):
+    return os.path.join(upload_dir(), '.partial', upload_id)
+
+def upload_status(upload):
+    partial = partial_upload_path(upload['id'])
+    received = upload['size'] if upload['path'] else (os.path.getsize(partial) if os.path.exists(partial) else 0)
+    return {
+        'id': upload['id'],
+        'filename': upload['filename'],
+        'size': upload['size'],
+        'received': received,
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE'],
+        'path': upload['path']
+    }
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+@app.route('/api/admin/uploads', methods=['POST'])
+@admin_required
+def create_upload():
+    data = request.get_json()
+    filename = secure_filename(data.get('filename', ''))
+    size = data.get('size')
+    sha256 = str(data.get('sha256', '')).lower()
+
+    if not filename or not allowed_file(filename):
+        return json_response('不支持的文件类型', 400)
+    if not isinstance(size, int) or size <= 0:
+        return json_response('文件大小无效', 400)
+    if size > app.config['UPLOAD_MAX_FILE_SIZE']:
+        return json_response('文件过大', 413)
+    if not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        return json_response('缺少有效的 SHA-256 校验值', 400)
+
+    upload_id = uuid.uuid4().hex
+    os.makedirs(os.path.dirname(partial_upload_path(upload_id)), exist_ok=True)
+    open(partial_upload_path(upload_id), 'wb').close()
+    DB.execute(
+        "INSERT INTO uploads (id, user_id, filename, size, sha256) VALUES (?, ?, ?, ?, ?)",
+        (upload_id, session['user_id'], filename, size, sha256),
+        commit=True
+    )
+    upload = DB.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,))[0]
+    return json_response('上传已创建', 201, upload_status(upload))
+
+@app.route('/api/admin/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@admin_required
+def manage_upload(upload_id):
+    upload = DB.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,))
+    if not upload:
+        return json_response('上传不存在', 404)
+    upload = upload[0]
+    partial = partial_upload_path(upload_id)
+
+    if request.method == 'GET':
+        return json_response(data=upload_status(upload))
+
+    if request.method == 'DELETE':
+        if os.path.exists(partial):
+            os.remove(partial)
+        DB.execute("DELETE FROM uploads WHERE id = ?", (upload_id,), commit=True)
+        return json_response('上传已取消')
+
+    if upload['path']:
+        return json_response('上传已完成', data=upload_status(upload))
+
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    received = os.path.getsize(partial)
+    if content_range is None or content_range.length != upload['size']:
+        return json_response('Content-Range 无效', 400)
+    if content_range.start != received:
+        # 分片必须从已接收位置开始，客户端据此续传
+        return json_response('分片位置不连续', 409, upload_status(upload))
+
+    # 请求体直接分块写入磁盘，不在内存中缓存整个分片
+    expected = content_range.stop - content_range.start
+    chunk_digest = hashlib.sha256()
+    written = 0
+    with open(partial, 'r+b') as f:
+        f.seek(received)
+        while written < expected:
+            block = request.stream.read(min(64 * 1024, expected - written))
+            if not block:
+                break
+            f.write(block)
+            chunk_digest.update(block)
+            written += len(block)
+        chunk_sha256 = request.headers.get('X-Chunk-SHA256')
+        if written != expected or (chunk_sha256 and chunk_sha256.lower() != chunk_digest.hexdigest()):
+            f.truncate(received)
+            return json_response('分片数据不完整或校验失败', 400, upload_status(upload))
+
+    if received + written < upload['size']:
+        return json_response(data=upload_status(upload))
+
+    if file_sha256(partial) != upload['sha256']:
+        os.remove(partial)
+        DB.execute("DELETE FROM uploads WHERE id = ?", (upload_id,), commit=True)
+        return json_response('文件校验失败，请重新上传', 400)
+
+    # 相同内容只保存一份
+    ext = upload['filename'].rsplit('.', 1)[1].lower()
+    target = os.path.join(upload_dir(), f"{upload['sha256'][:32]}.{ext}")
+    deduplicated = os.path.exists(target)
+    if deduplicated:
+        os.remove(partial)
+    else:
+        os.replace(partial, target)
+    path = os.path.relpath(target, os.path.join(app.root_path, 'static')).replace(os.sep, '/')
+    DB.execute("UPDATE uploads SET path = ? WHERE id = ?", (path, upload_id), commit=True)
+
+    upload = DB.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,))[0]
+    return json_response('上传完成', data=dict(upload_status(upload), deduplicated=deduplicated))
+
+@app.route('/api/admin/users/<int:user_id>', methods=['PUT', 'DELETE'])
+@admin_required
+def manage_user(user_id):
+    user = DB.execute("SELECT id FROM users WHERE id = ?", (user_id,))
+    if not user:
+        return json_response('用户不存在', 404)
+
+    if request.method == 'PUT':
+        role = (request.get_json() or {}).get('role')
+        if role not in ('user', 'admin'):
+            return json_response('角色无效', 400)
+        DB.execute("UPDATE users SET role = ? WHERE id = ?", (role, user_id), commit=True)
+        revoke_cached_user(user_id)
+        return json_response('用户已更新')
+
+    elif request.method == 'DELETE':
+        songs = list(dict.fromkeys(row['song_id'] for row in DB.execute(
+            "SELECT song_id FROM comments WHERE user_id = ? UNION ALL SELECT song_id FROM favorites WHERE user_id = ?",
+            (user_id, user_id))))
+        with DB.transaction():
+            DB.execute('''
+                UPDATE music SET comment_count = comment_count - (
+                    SELECT COUNT(*) FROM comments
+                    WHERE comments.song_id = music.id AND comments.user_id = ?
+                )
+                WHERE id IN (SELECT song_id FROM comments WHERE user_id = ?)
+            ''', (user_id, user_id))
+            DB.execute("DELETE FROM comments WHERE user_id = ?", (user_id,))
+            DB.execute('''
+                UPDATE music SET favorite_count = favorite_count - 1
+                WHERE id IN (SELECT song_id FROM favorites WHERE user_id = ?)
+            ''', (user_id,))
+            DB.execute('''
+                UPDATE favorite_buckets SET count = count - 1
+                WHERE (day, song_id) IN (
+                    SELECT SUBSTR(created_at, 1, 10), song_id FROM favorites WHERE user_id = ?
+                )
+            ''', (user_id,))
+            DB.execute("DELETE FROM favorites WHERE user_id = ?", (user_id,))
+            DB.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        get_session_store().revoke_user(user_id)
+        revoke_cached_user(user_id)
+        for song_id in songs:
+            invalidate_song_cache(song_id, listing=False)
+        return json_response('用户已删除')
+
+# 批量导入导出：NDJSON 每行一个对象，CSV 首行为列名
+def read_bulk_rows(stream, fmt):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        for row in csv.DictReader(text):
+            yield row
+        return
+    for line in text:
+        if not line.strip():
+            yield None
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield ValueError('JSON 格式错误')
+            continue
+        yield row if isinstance(row, dict) else ValueError('每行必须是 JSON 对象')
+
+def normalize_bulk_row(row):
+    # 返回 (字段值, 错误)；字段值统一为字符串，数字按原样转换（如 release_date: 2020）
+    missing = [field for field in SONG_REQUIRED_FIELDS if row.get(field) is None]
+    if missing:
+        return None, f"缺少必要字段: {', '.join(missing)}"
+    values = {}
+    for field in SONG_REQUIRED_FIELDS:
+        value = row[field]
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            return None, f'字段 {field} 必须是字符串'
+        values[field] = str(value)
+    if not values['title'] or not values['artist']:
+        return None, '标题和歌手不能为空'
+    return values, None
+
+def insert_song_batch(batch):
+    # 事务内写入，AUTOINCREMENT 的新 id 连续分配在 sqlite_sequence 记录的值之后，据此同步全文索引
+    full_text_search = get_backend().full_text_search
+    with DB.transaction():
+        if full_text_search:
+            last_id = DB.execute('''
+                SELECT MAX(
+                    COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'music'), 0),
+                    COALESCE((SELECT MAX(id) FROM music), 0)
+                ) AS id
+            ''')[0]['id']
+        DB.executemany(
+            '''
+            INSERT INTO music (
+                title, artist, album, duration, cover_path,
+                audio_path, genre, release_date, lyrics
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            [tuple(row[field] for field in SONG_REQUIRED_FIELDS) for _, row in batch]
+        )
+        if not full_text_search:
+            return
+        DB.executemany(
+            "INSERT INTO music_fts (rowid, title, artist, album, lyrics, categories) VALUES (?, ?, ?, ?, ?, '')",
+            [(last_id + i + 1, segment_text(row['title']), segment_text(row['artist']),
+              segment_text(row['album']), segment_text(row['lyrics'])) for i, (_, row) in enumerate(batch)]
+        )
+
+@app.route('/api/admin/songs/bulk', methods=['POST'])
+@admin_required
+def bulk_import_songs():
+    fmt = 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'ndjson'
+    stream = get_input_stream(request.environ, max_content_length=app.config['BULK_IMPORT_MAX_SIZE'])
+
+    imported = 0
+    errors = []
+    batch = []
+
+    def flush():
+        nonlocal imported
+        try:
+            insert_song_batch(batch)
+            imported += len(batch)
+        except DatabaseError:
+            # 整批已回滚：逐行重试，只有真正出错的行记入错误
+            for item in batch:
+                try:
+                    insert_song_batch([item])
+                    imported += 1
+                except DatabaseError as e:
+                    errors.append({'line': item[0], 'error': str(e)})
+        batch.clear()
+
+    # CSV 首行为表头，数据从第 2 行开始
+    first_line = 2 if fmt == 'csv' else 1
+    for line, row in enumerate(read_bulk_rows(stream, fmt), first_line):
+        if row is None:
+            continue
+        if isinstance(row, ValueError):
+            errors.append({'line': line, 'error': str(row)})
+            continue
+        values, error = normalize_bulk_row(row)
+        if error:
+            errors.append({'line': line, 'error': error})
+            continue
+        batch.append((line, values))
+        if len(batch) >= app.config['BULK_BATCH_SIZE']:
+            flush()
+    if batch:
+        flush()
+
+    if imported:
+        invalidate_song_cache()
+    return json_response(f'已导入 {imported} 首歌曲', data={'imported': imported, 'errors': errors})
+
+@app.route('/api/admin/songs/export', methods=['GET'])
+@admin_required
+def export_songs():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return json_response('format 参数无效', 400)
+    batch_size = app.config['BULK_BATCH_SIZE']
+    columns = ', '.join(SONG_FIELDS)
+
+    def rows():
+        # 按 id 分批读取，不一次性载入整张表
+        last_id = 0
+        while True:
+            songs = DB.execute(f"SELECT {columns} FROM music WHERE id > ? ORDER BY id LIMIT ?",
+                               (last_id, batch_size))
+            if not songs:
+                return
+            yield from songs
+            last_id = songs[-1]['id']
+
+    def generate():
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(SONG_FIELDS)
+            for song in rows():
+                writer.writerow([song[field] for field in SONG_FIELDS])
+                if buffer.tell() > 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for song in rows():
+                yield json.dumps(song_dict(song), ensure_ascii=False) + '\n'
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    resp = app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers['Content-Disposition'] = f'attachment; filename=songs.{fmt}'
+    return resp
+
+@app.route('/api/admin/cache', methods=['GET', 'DELETE'])
+@admin_required
+def manage_cache():
+    if request.method == 'DELETE':
+        get_cache().clear()
+        return json_response('缓存已清空')
+    return json_response(data=get_cache().stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not app.config['METRICS_ENABLED']:
+        return json_response('监控指标未开启', 404)
+    # 采集端使用 METRICS_TOKEN；未配置时只有管理员登录后可以访问
+    token = app.config['METRICS_TOKEN']
+    if not (token and secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')):
+        if g.user is None:
+            return json_response('请先登录', 401)
+        if g.user['role'] != 'admin':
+            return json_response('需要管理员权限', 403)
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # 静态文件路由
 @app.route('/static/<path:filename>')
 def serve_static(filename):
+    # 封面衍生图文件名带内容哈希，内容不会变化，可长期缓存
+    if filename.startswith(app.config['COVER_VARIANTS_DIR'] + '/'):
+        resp = send_from_directory('static', filename, max_age=app.config['MEDIA_MAX_AGE'])
+        resp.cache_control.public = True
+        resp.cache_control.immutable = True
+        return resp
     return send_from_directory('static', filename)
 
-# 初始化应用
+# uvicorn 入口：uvicorn app:serve --factory --interface wsgi。uvicorn 的 WSGI 接口把每个请求交给线程池执行，
+# 慢速的音频流不会阻塞其他请求。每个 worker 启动时调用一次：依次执行迁移（加锁，避免多个 worker 同时迁移），
+# 并由其中一个 worker 同步只读副本
+def serve():
+    lock = process_lock('migrate')
+    try:
+        init_db()
+    finally:
+        lock.close()
+    start_replica_sync()
+    return app
+
+# 初始化应用；生产环境见 gunicorn.conf.py
 if __name__ == '__main__':
     init_db()
+    # 调试模式下由重载器启动的子进程负责处理请求，副本同步只在该进程中运行
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_replica_sync()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# 接口性能基准：python bench.py [--songs N | --database 已生成的库] [--requests N] [--output results.json]
+# 与之前的结果比较：python bench.py --baseline results.json
+# 对运行中的服务压测：python bench.py --url http://127.0.0.1:5000 [--concurrency N]
+# 同时测试 PostgreSQL 后端：python bench.py --pg-url postgresql://localhost/music_bench（该库的 public schema 会被清空）
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, init_db, DB, get_cache
+from datagen import generate, skewed
+
+# 参与对比的连接配置：每条语句新建连接、无 PRAGMA（原先的 DB.execute） vs 请求内复用连接池连接 + 调优 PRAGMA。
+# 均关闭响应缓存（CACHE_MAX_ENTRIES 为 0），重复的 GET 场景每次都查询数据库，比较的是连接处理本身
+CONFIGS = {
+    'no-pool': {'DB_POOL_SIZE': 0, 'DB_CONNECTION_PER_QUERY': True, 'DB_PRAGMAS': {}, 'CACHE_MAX_ENTRIES': 0},
+    'pooled': {'DB_POOL_SIZE': app.config['DB_POOL_SIZE'], 'DB_CONNECTION_PER_QUERY': False,
+               'DB_PRAGMAS': app.config['DB_PRAGMAS'], 'CACHE_MAX_ENTRIES': 0},
+}
+
+BENCH_SONG = {
+    'title': 'Bench Song', 'artist': 'Bench', 'album': 'Bench', 'duration': '3:30',
+    # 不存在的文件，避免触发后台封面和音频处理
+    'cover_path': 'covers/bench-missing.jpg', 'audio_path': 'audio/bench-missing.mp3',
+    'genre': 'pop', 'release_date': '2024-01-01', 'lyrics': 'la la la'
+}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(latencies, elapsed, errors):
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': errors,
+    }
+
+
+# 每个场景根据请求序号生成 (method, path, kwargs)；歌曲 id 按与合成数据相同的热度分布选取
+def scenarios(song_count, seed):
+    rng = random.Random(seed)
+
+    def song_id():
+        return skewed(rng, song_count, 3)
+
+    favorite_ids = []
+
+    def favorite(i):
+        # 偶数次收藏、奇数次取消同一首歌，收藏表规模保持稳定
+        if i % 2 == 0:
+            favorite_ids.append(song_id())
+            return 'POST', f'/api/favorites/{favorite_ids[-1]}', {}
+        return 'DELETE', f'/api/favorites/{favorite_ids.pop()}', {}
+
+    return {
+        'GET /api/songs': lambda i: ('GET', '/api/songs', {}),
+        'GET /api/songs?genre': lambda i: ('GET', '/api/songs?genre=pop&sort=-duration', {}),
+        'GET /api/songs/<id>': lambda i: ('GET', f'/api/songs/{song_id()}', {}),
+        'GET /api/search': lambda i: ('GET', '/api/search?q=love', {}),
+        'POST|DELETE /api/favorites/<id>': favorite,
+        'POST /api/comments': lambda i: ('POST', '/api/comments', {'json': {'song_id': song_id(), 'content': 'bench'}}),
+        'POST /api/admin/songs': lambda i: ('POST', '/api/admin/songs', {'json': BENCH_SONG}),
+        'PUT /api/admin/songs/<id>': lambda i: ('PUT', f'/api/admin/songs/{song_id()}', {'json': BENCH_SONG}),
+    }
+
+
+def run(client, count, make_request):
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(count):
+        method, path, kwargs = make_request(i)
+        began = time.perf_counter()
+        resp = client.open(path, method=method, **kwargs)
+        latencies.append(time.perf_counter() - began)
+        if resp.status_code >= 500:
+            errors += 1
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def prepare_template(args):
+    # 合成数据只生成一次，每种配置使用一份副本
+    if args.database:
+        return args.database
+    path = os.path.join(tempfile.mkdtemp(), 'bench-template.db')
+    app.config['DATABASE'] = path
+    init_db()
+    with app.app_context():
+        generate(songs=args.songs, users=max(1, args.songs // 10), favorites=args.songs * 5,
+                 comments=args.songs * 2, categories=50, seed=args.seed, log=lambda *_: None)
+    DB.close_pools()
+    return path
+
+
+def prepare_postgres(args):
+    # 每次运行重建 schema，以相同的种子生成与 SQLite 模板一致的数据
+    app.config.update({'DATABASE': args.pg_url, 'DB_BACKEND': 'postgresql'})
+    DB.execute("DROP SCHEMA public CASCADE")
+    DB.execute("CREATE SCHEMA public")
+    init_db()
+    with app.app_context():
+        generate(songs=args.songs, users=max(1, args.songs // 10), favorites=args.songs * 5,
+                 comments=args.songs * 2, categories=50, seed=args.seed, log=lambda *_: None)
+
+
+def bench(name, template, args):
+    DB.close_pools()
+    app.config.update(CONFIGS[name])
+    # 缓存实例已创建，容量需要直接更新
+    cache = get_cache()
+    cache.clear()
+    cache.max_entries = app.config['CACHE_MAX_ENTRIES']
+    if name == 'postgresql':
+        prepare_postgres(args)
+    else:
+        app.config.update({'DATABASE': os.path.join(tempfile.mkdtemp(), f'bench-{name}.db'), 'DB_BACKEND': 'sqlite'})
+        shutil.copyfile(template, app.config['DATABASE'])
+        init_db()
+    song_count = DB.execute("SELECT MAX(id) AS n FROM music")[0]['n'] or 1
+
+    client = app.test_client()
+    admin = app.config['DEFAULT_ADMIN']
+    client.post('/api/auth/login', json={'username': admin['username'], 'password': admin['password']})
+
+    results = {route: run(client, args.requests, make_request)
+               for route, make_request in scenarios(song_count, args.seed).items()}
+    DB.close_pools()
+    return results
+
+
+# HTTP 模式：并发请求已启动的服务，统计吞吐和 p50/p99 延迟，用于比较开发服务器与 gunicorn/uvicorn
+def http_bench(base_url, request_count, concurrency, song_id):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    admin = app.config['DEFAULT_ADMIN']
+    login = urllib.request.Request(
+        base_url + '/api/auth/login',
+        data=json.dumps({'username': admin['username'], 'password': admin['password']}).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    opener.open(login).read()
+
+    routes = {
+        'GET /api/songs': ('GET', '/api/songs'),
+        'GET /api/songs/<id>': ('GET', f'/api/songs/{song_id}'),
+        'GET /api/songs/<id>/stream': ('GET', f'/api/songs/{song_id}/stream'),
+        'POST /api/favorites/<id>': ('POST', f'/api/favorites/{song_id}'),
+    }
+
+    def timed(method, path):
+        start = time.perf_counter()
+        try:
+            opener.open(urllib.request.Request(base_url + path, method=method)).read()
+            ok = True
+        except urllib.error.HTTPError as e:
+            e.read()
+            ok = e.code < 500
+        except OSError:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for name, (method, path) in routes.items():
+            start = time.perf_counter()
+            samples = list(executor.map(lambda _: timed(method, path), range(request_count)))
+            results[name] = summarize([latency for latency, _ in samples], time.perf_counter() - start,
+                                      sum(1 for _, ok in samples if not ok))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(all_results, baseline):
+    print(f"{'config':<10}{'route':<34}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}"
+          + ('   vs baseline (req/s, p99)' if baseline else ''))
+    for config, results in all_results.items():
+        for route, r in results.items():
+            line = (f"{config:<10}{route:<34}{r['rps']:>10.1f}{r['p50_ms']:>10.2f}"
+                    f"{r['p99_ms']:>10.2f}{r['errors']:>8}")
+            old = (baseline or {}).get(config, {}).get(route)
+            if old:
+                line += f"   {r['rps'] / old['rps'] - 1:+7.1%} {r['p99_ms'] / old['p99_ms'] - 1:+7.1%}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='音乐接口基准测试')
+    parser.add_argument('--songs', type=int, default=2000, help='合成数据的歌曲数')
+    parser.add_argument('--database', help='使用 datagen.py 生成的数据库（会复制后再测试）')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果写入 JSON 文件，便于在提交之间比较')
+    parser.add_argument('--baseline', help='之前 --output 生成的 JSON 文件')
+    parser.add_argument('--url', help='压测已启动的服务，例如 http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--song-id', type=int, default=1)
+    parser.add_argument('--pg-url', help='同时测试 PostgreSQL 后端，使用该连接串指向的专用测试库')
+    args = parser.parse_args()
+    if args.pg_url:
+        CONFIGS['postgresql'] = {'DB_POOL_SIZE': app.config['DB_POOL_SIZE'], 'DB_CONNECTION_PER_QUERY': False,
+                                 'DB_PRAGMAS': {}, 'CACHE_MAX_ENTRIES': 0}
+
+    # 计时不包含指标采集和慢查询日志
+    original = {key: app.config[key] for key in
+                ('DATABASE', 'DB_BACKEND', 'DB_POOL_SIZE', 'DB_CONNECTION_PER_QUERY', 'DB_PRAGMAS',
+                 'CACHE_MAX_ENTRIES', 'METRICS_ENABLED', 'SLOW_QUERY_MS')}
+    app.config.update({'METRICS_ENABLED': False, 'SLOW_QUERY_MS': None})
+    if args.url:
+        all_results = {'http': http_bench(args.url.rstrip('/'), args.requests, args.concurrency, args.song_id)}
+    else:
+        template = prepare_template(args)
+        all_results = {name: bench(name, template, args) for name in CONFIGS}
+    app.config.update(original)
+    get_cache().max_entries = app.config['CACHE_MAX_ENTRIES']
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(all_results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'commit': git_commit(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'args': vars(args),
+                'results': all_results,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
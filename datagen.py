@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# 生成基准测试用的合成数据：python datagen.py --database bench.db --songs 100000
+# 歌曲热度、用户活跃度按幂律分布：少数热门歌曲和活跃用户占大部分收藏和评论；固定 --seed 时结果可复现
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from app import app, init_db, DB, get_backend, hash_password, refresh_related, segment_text
+
+GENRES = ('pop', 'rock', 'jazz', 'classical', 'hip-hop', 'electronic', 'folk', 'r&b', 'metal', 'country')
+WORDS = ('love', 'night', 'summer', 'river', 'light', 'dream', 'city', 'fire', 'rain', 'heart',
+         '夜空', '晴天', '远方', '海风', '星光', '回忆', '青春', '月亮')
+HISTORY_DAYS = 365
+BATCH_SIZE = 10000
+
+
+def skewed(rng, count, skew):
+    # 返回 1..count 之间的 id，skew 越大越集中在小 id（热门）上
+    return min(count, int(count * rng.random() ** skew) + 1)
+
+
+def created_at(rng, now):
+    # 与 CURRENT_TIMESTAMP 相同的 UTC 文本格式，各后端通用
+    return (now - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def insert_batches(query, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            with DB.transaction():
+                DB.executemany(query, batch)
+            batch = []
+    if batch:
+        with DB.transaction():
+            DB.executemany(query, batch)
+
+
+def generate_songs(rng, count, artists, now):
+    for i in range(1, count + 1):
+        title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+        artist = f'Artist {skewed(rng, artists, 2)}'
+        seconds = rng.randint(90, 420)
+        yield (
+            f'{title} {i}', artist, f'Album {i // 12}', f'{seconds // 60}:{seconds % 60:02d}', seconds,
+            'covers/forever.jpg', 'audio/song11.mp3', rng.choice(GENRES),
+            f'{rng.randint(1990, 2025)}-01-01', ' '.join(rng.choice(WORDS) for _ in range(30)),
+            created_at(rng, now)
+        )
+
+
+def generate(songs, users, favorites, comments, categories, seed=0, skew=3.0, log=print):
+    """向当前 DATABASE 写入合成数据（需为新初始化的数据库），完成后同步计数列、分类列和全文索引"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    start = time.perf_counter()
+
+    password = hash_password('password')
+    insert_batches(
+        "INSERT INTO users (username, password, email, role) VALUES (?, ?, ?, 'user')",
+        ((f'user{i}', password, f'user{i}@example.com') for i in range(1, users + 1))
+    )
+    user_ids = [row['id'] for row in DB.execute("SELECT id FROM users ORDER BY id")]
+    log(f'users: {len(user_ids)}')
+
+    insert_batches(
+        '''
+        INSERT INTO music (
+            title, artist, album, duration, duration_seconds, cover_path,
+            audio_path, genre, release_date, lyrics, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''',
+        generate_songs(rng, songs, max(1, songs // 20), now)
+    )
+    log(f'music: {songs}')
+
+    insert_batches(
+        "INSERT INTO categories (name, type) VALUES (?, ?)",
+        ((f'{"tag" if i % 3 == 0 else "category"}-{i}', 'tag' if i % 3 == 0 else 'category')
+         for i in range(1, categories + 1))
+    )
+    if categories:
+        insert_batches(
+            "INSERT INTO song_categories (song_id, category_id) VALUES (?, ?) ON CONFLICT DO NOTHING",
+            ((song_id, skewed(rng, categories, 2))
+             for song_id in range(1, songs + 1) for _ in range(rng.randint(1, 3)))
+        )
+    log(f'categories: {categories}')
+
+    def pick_user():
+        return user_ids[skewed(rng, len(user_ids), skew) - 1]
+
+    insert_batches(
+        "INSERT INTO favorites (user_id, song_id, created_at) VALUES (?, ?, ?) ON CONFLICT DO NOTHING",
+        ((pick_user(), skewed(rng, songs, skew), created_at(rng, now)) for _ in range(favorites))
+    )
+    log(f'favorites: {favorites}')
+
+    insert_batches(
+        "INSERT INTO comments (song_id, user_id, content, created_at) VALUES (?, ?, ?, ?)",
+        ((skewed(rng, songs, skew), pick_user(), ' '.join(rng.choice(WORDS) for _ in range(8)), created_at(rng, now))
+         for _ in range(comments))
+    )
+    log(f'comments: {comments}')
+
+    # 冗余列与写入路径保持一致
+    with DB.transaction():
+        DB.execute('''
+            UPDATE music SET favorite_count = c.n
+            FROM (SELECT song_id, COUNT(*) AS n FROM favorites GROUP BY song_id) c
+            WHERE music.id = c.song_id
+        ''')
+        DB.execute('''
+            UPDATE music SET comment_count = c.n
+            FROM (SELECT song_id, COUNT(*) AS n FROM comments GROUP BY song_id) c
+            WHERE music.id = c.song_id
+        ''')
+        DB.execute('''
+            INSERT INTO favorite_buckets (day, song_id, count)
+            SELECT SUBSTR(created_at, 1, 10), song_id, COUNT(*) FROM favorites
+            GROUP BY SUBSTR(created_at, 1, 10), song_id
+        ''')
+
+    # 分类列在 Python 中拼成 JSON，避免依赖各数据库的 JSON 聚合函数
+    full_text_search = get_backend().full_text_search
+    last_id = 0
+    while True:
+        rows = DB.execute('''
+            SELECT id, title, artist, album, lyrics FROM music
+            WHERE id > ? AND id <= ?
+            ORDER BY id
+        ''', (last_id, last_id + BATCH_SIZE))
+        if not rows:
+            break
+        names = {row['id']: ([], []) for row in rows}
+        for link in DB.execute('''
+            SELECT sc.song_id, c.name, c.type
+            FROM song_categories sc
+            JOIN categories c ON c.id = sc.category_id
+            WHERE sc.song_id > ? AND sc.song_id <= ?
+            ORDER BY sc.song_id, c.id
+        ''', (last_id, last_id + BATCH_SIZE)):
+            song_categories, song_tags = names[link['song_id']]
+            song_categories.append(link['name'])
+            if link['type'] == 'tag':
+                song_tags.append(link['name'])
+        with DB.transaction():
+            DB.executemany(
+                "UPDATE music SET categories = ?, tags = ? WHERE id = ?",
+                [(json.dumps(names[row['id']][0], ensure_ascii=False),
+                  json.dumps(names[row['id']][1], ensure_ascii=False), row['id']) for row in rows]
+            )
+            if full_text_search:
+                DB.executemany(
+                    "INSERT INTO music_fts (rowid, title, artist, album, lyrics, categories) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(row['id'], segment_text(row['title']), segment_text(row['artist']), segment_text(row['album']),
+                      segment_text(row['lyrics']), segment_text(' '.join(names[row['id']][0])))
+                     for row in rows]
+                )
+        last_id = rows[-1]['id']
+
+    # 预计算相关歌曲，详情接口与线上一样直接查表，而不是走随机补齐
+    for song_id in range(1, songs + 1):
+        refresh_related(song_id)
+    log(f'related songs: {songs}')
+    DB.execute("ANALYZE")
+    log(f'done in {time.perf_counter() - start:.1f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成测试数据')
+    parser.add_argument('--database', required=True,
+                        help='输出的数据库文件（不能已存在）；postgresql 后端为连接串，需指向空库')
+    parser.add_argument('--backend', choices=('sqlite', 'postgresql'), default='sqlite')
+    parser.add_argument('--songs', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=None, help='默认为歌曲数的 1/10')
+    parser.add_argument('--favorites', type=int, default=None, help='默认为歌曲数的 5 倍')
+    parser.add_argument('--comments', type=int, default=None, help='默认为歌曲数的 2 倍')
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--skew', type=float, default=3.0, help='热度集中程度，1 为均匀分布')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.backend == 'sqlite' and os.path.exists(args.database):
+        parser.error(f'{args.database} 已存在')
+    # 批量写入的大事务不计入指标，也不作为慢查询记录
+    app.config.update({'DATABASE': args.database, 'DB_BACKEND': args.backend,
+                       'METRICS_ENABLED': False, 'SLOW_QUERY_MS': None})
+    init_db()
+    generate(
+        songs=args.songs,
+        users=args.users if args.users is not None else max(1, args.songs // 10),
+        favorites=args.favorites if args.favorites is not None else args.songs * 5,
+        comments=args.comments if args.comments is not None else args.songs * 2,
+        categories=args.categories,
+        seed=args.seed,
+        skew=args.skew,
+    )
+    # 关闭连接时写回 WAL，生成的库可以直接复制使用
+    DB.close_pools()
+
+
+if __name__ == '__main__':
+    main()
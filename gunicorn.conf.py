@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# 生产环境启动：gunicorn -c gunicorn.conf.py app:app
+# 多进程 + 每进程多线程（gthread），慢速下载音频的客户端只占用一个线程，不会阻塞整个进程
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 8))
+# 音频流式传输可能持续较长时间；条件允许时应配置 MEDIA_ACCEL_REDIRECT_PREFIX 交给 nginx 发送
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+# 定期重启 worker，防止内存缓慢增长
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = '-'
+
+
+def on_starting(server):
+    # 迁移只在主进程执行一次；fork 之前关闭连接，避免子进程继承 SQLite 连接
+    from app import DB, init_db
+    init_db()
+    DB.close_pools()
+
+
+def when_ready(server):
+    # 内存缓存按进程独立，缓存失效无法通知其他 worker
+    from app import app, start_replica_sync
+    if workers > 1 and app.config['CACHE_BACKEND'] == 'memory':
+        server.log.warning('多个 worker 使用内存缓存时各进程的失效互不可见，建议 CACHE_BACKEND=redis')
+    # 只读副本只由主进程同步，worker 之间不重复复制；各 worker 通过 catalog_version 得知同步完成并清空自己的缓存
+    start_replica_sync()
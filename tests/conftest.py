@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# 接口测试：每个用例分别在 SQLite 和 PostgreSQL 上运行。
+# PostgreSQL 需要安装 psycopg 并设置 TEST_POSTGRES_URL 指向专用测试库（每个用例会清空其 public schema），否则跳过
+import os
+
+import pytest
+
+import app as music
+
+ADMIN = {k: music.app.config['DEFAULT_ADMIN'][k] for k in ('username', 'password')}
+
+# 不存在的文件，避免触发后台封面和音频处理
+SONG = {
+    'title': 'Test Song', 'artist': 'Tester', 'album': 'Tests', 'duration': '3:30',
+    'cover_path': 'covers/test-missing.jpg', 'audio_path': 'audio/test-missing.mp3',
+    'genre': 'pop', 'release_date': '2024-01-01', 'lyrics': 'la la la'
+}
+
+# 按进程缓存的单例，每个用例重新创建
+SINGLETONS = ('_cache', '_favorite_versions', '_login_limiter', '_session_store', '_user_cache', '_revocations_seen',
+              '_replica_version_seen', '_write_queue')
+
+
+def reset_postgres():
+    music.DB.execute("DROP SCHEMA public CASCADE")
+    music.DB.execute("CREATE SCHEMA public")
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def backend(request, tmp_path, monkeypatch):
+    config = music.app.config
+    if request.param == 'postgresql':
+        url = os.environ.get('TEST_POSTGRES_URL')
+        if music.psycopg is None or not url:
+            pytest.skip('需要安装 psycopg 并设置 TEST_POSTGRES_URL')
+        monkeypatch.setitem(config, 'DATABASE', url)
+    else:
+        monkeypatch.setitem(config, 'DATABASE', str(tmp_path / 'test.db'))
+    monkeypatch.setitem(config, 'DB_BACKEND', request.param)
+    monkeypatch.setitem(config, 'DB_REPLICAS', [])
+    monkeypatch.setitem(config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setitem(config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    monkeypatch.setitem(config, 'TESTING', True)
+    for name in SINGLETONS:
+        monkeypatch.setattr(music, name, None)
+    music.DB.close_pools()
+    music.metrics.reset()
+    if request.param == 'postgresql':
+        reset_postgres()
+    music.init_db()
+    yield request.param
+    if music._write_queue is not None:
+        music._write_queue.close()
+    music.DB.close_pools()
+
+
+@pytest.fixture
+def client(backend):
+    return music.app.test_client()
+
+
+def login(client, username, password):
+    return client.post('/api/auth/login', json={'username': username, 'password': password})
+
+
+@pytest.fixture
+def admin(backend):
+    client = music.app.test_client()
+    assert login(client, **ADMIN).status_code == 200
+    return client
+
+
+@pytest.fixture
+def user(backend):
+    client = music.app.test_client()
+    resp = client.post('/api/auth/register',
+                       json={'username': 'alice', 'password': 'pw', 'confirm_password': 'pw'})
+    assert resp.status_code == 201
+    client.user_id = resp.json['data']['id']
+    return client
+
+
+@pytest.fixture
+def create_song(admin):
+    def create(**fields):
+        resp = admin.post('/api/admin/songs', json=dict(SONG, **fields))
+        assert resp.status_code == 201, resp.json
+        return resp.json['data']['id']
+    return create
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+
+import app as music
+from conftest import SONG
+
+
+def test_song_crud(admin, create_song):
+    song_id = create_song()
+    assert [s['id'] for s in admin.get('/api/admin/songs').json['data']] == [song_id]
+
+    resp = admin.put(f'/api/admin/songs/{song_id}', json=dict(SONG, title='Renamed'))
+    assert resp.status_code == 200
+    assert admin.get(f'/api/songs/{song_id}').json['data']['song']['title'] == 'Renamed'
+    assert admin.get('/api/search?q=renamed').json['data']['songs'][0]['id'] == song_id
+
+    assert admin.put(f'/api/admin/songs/{song_id}', json={'title': 'x'}).status_code == 400
+    assert admin.post('/api/admin/songs', json={'title': 'x'}).status_code == 400
+
+    assert admin.delete(f'/api/admin/songs/{song_id}').status_code == 200
+    assert admin.get(f'/api/songs/{song_id}').status_code == 404
+    assert admin.get('/api/songs').json['data']['songs'] == []
+    assert admin.delete(f'/api/admin/songs/{song_id}').status_code == 404
+
+
+def test_category_management(admin, create_song):
+    song_id = create_song()
+    resp = admin.post('/api/admin/categories', json={'name': 'Chill', 'description': 'slow'})
+    assert resp.status_code == 201
+    category_id = resp.json['data']['id']
+    assert admin.post('/api/admin/categories', json={'name': 'Chill'}).status_code == 409
+    assert admin.post('/api/admin/categories', json={'name': ''}).status_code == 400
+    admin.post(f'/api/admin/categories/{category_id}/songs', json={'song_ids': [song_id]})
+
+    assert admin.put(f'/api/admin/categories/{category_id}', json={'name': 'Calm'}).status_code == 200
+    assert admin.get(f'/api/songs/{song_id}').json['data']['song']['categories'] == ['Calm']
+
+    resp = admin.delete(f'/api/admin/categories/{category_id}/songs', json={'song_ids': [song_id]})
+    assert resp.json['data'] == {'changed': 1, 'missing': []}
+    assert admin.post(f'/api/admin/categories/{category_id}/songs', json={'song_ids': []}).status_code == 400
+
+    assert admin.delete(f'/api/admin/categories/{category_id}').status_code == 200
+    assert admin.get('/api/categories').json['data'] == []
+    assert admin.put(f'/api/admin/categories/{category_id}', json={'name': 'x'}).status_code == 404
+
+
+def test_chunked_upload(admin):
+    content = b'ID3' + bytes(range(256)) * 40
+    digest = hashlib.sha256(content).hexdigest()
+    resp = admin.post('/api/admin/uploads', json={'filename': 'a.mp3', 'size': len(content), 'sha256': digest})
+    assert resp.status_code == 201
+    upload_id = resp.json['data']['id']
+
+    half = len(content) // 2
+    resp = admin.put(f'/api/admin/uploads/{upload_id}', data=content[:half],
+                     headers={'Content-Range': f'bytes 0-{half - 1}/{len(content)}'})
+    assert resp.json['data']['received'] == half
+    # 分片必须从已接收位置继续
+    resp = admin.put(f'/api/admin/uploads/{upload_id}', data=content[:half],
+                     headers={'Content-Range': f'bytes 0-{half - 1}/{len(content)}'})
+    assert resp.status_code == 409
+    resp = admin.put(f'/api/admin/uploads/{upload_id}', data=content[half:],
+                     headers={'Content-Range': f'bytes {half}-{len(content) - 1}/{len(content)}'})
+    assert resp.status_code == 200
+    assert resp.json['data']['path'].endswith(f'{digest[:32]}.mp3')
+    assert admin.get(f'/api/admin/uploads/{upload_id}').json['data']['received'] == len(content)
+
+    assert admin.delete(f'/api/admin/uploads/{upload_id}').status_code == 200
+    assert admin.get(f'/api/admin/uploads/{upload_id}').status_code == 404
+    resp = admin.post('/api/admin/uploads', json={'filename': 'a.exe', 'size': 1, 'sha256': digest})
+    assert resp.status_code == 400
+
+
+def test_bulk_import_and_export(admin):
+    rows = [dict(SONG, title='Bulk 1'), dict(SONG, title='Bulk 2', release_date=2020), dict(SONG, title=True)]
+    body = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+    resp = admin.post('/api/admin/songs/bulk', data=body, content_type='application/x-ndjson')
+    assert resp.status_code == 200
+    assert resp.json['data']['imported'] == 2
+    assert [e['line'] for e in resp.json['data']['errors']] == [3, 4]
+    assert admin.get('/api/search?q=bulk').json['data']['songs']
+
+    csv_body = ','.join(SONG) + '\n' + ','.join(dict(SONG, title='Csv Song').values()) + '\n'
+    resp = admin.post('/api/admin/songs/bulk', data=csv_body, content_type='text/csv')
+    assert resp.json['data'] == {'imported': 1, 'errors': []}
+
+    exported = [json.loads(line) for line in admin.get('/api/admin/songs/export').get_data(as_text=True).splitlines()]
+    assert [song['title'] for song in exported] == ['Bulk 1', 'Bulk 2', 'Csv Song']
+    assert exported[1]['release_date'] == '2020'
+    csv_lines = admin.get('/api/admin/songs/export?format=csv').get_data(as_text=True).splitlines()
+    assert len(csv_lines) == 4
+    assert admin.get('/api/admin/songs/export?format=xml').status_code == 400
+
+
+def test_cache_and_metrics(admin, client, create_song):
+    create_song()
+    client.get('/api/songs')
+    client.get('/api/songs')
+    stats = admin.get('/api/admin/cache').json['data']
+    resp = admin.get('/metrics')
+    assert resp.status_code == 200
+    text = resp.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/songs"' in text
+    assert f"cache_hits_total {stats['hits']}" in text.splitlines()
+    assert f"cache_misses_total {stats['misses']}" in text.splitlines()
+    assert 'db_connections{pool="primary",state="idle"}' in text
+    assert music.app.config['DATABASE'] not in text
+    assert admin.delete('/api/admin/cache').status_code == 200
+
+
+def test_metrics_require_admin_or_token(client, user, monkeypatch):
+    assert client.get('/metrics').status_code == 401
+    assert user.get('/metrics').status_code == 403
+    monkeypatch.setitem(music.app.config, 'METRICS_TOKEN', 'secret')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import app as music
+
+from conftest import ADMIN, login
+
+
+def test_register_login_logout(client):
+    resp = client.post('/api/auth/register', json={'username': 'bob', 'password': 'pw', 'confirm_password': 'pw'})
+    assert resp.status_code == 201
+    assert resp.json['data']['role'] == 'user'
+    assert client.get('/api/auth/me').json['data']['username'] == 'bob'
+
+    assert client.post('/api/auth/logout').status_code == 200
+    assert client.get('/api/auth/me').status_code == 401
+
+    resp = login(client, 'bob', 'pw')
+    assert resp.status_code == 200
+    assert resp.json['data']['username'] == 'bob'
+    assert client.get('/api/auth/me').status_code == 200
+
+
+def test_register_validation(client):
+    resp = client.post('/api/auth/register', json={'username': 'bob', 'password': 'pw', 'confirm_password': 'x'})
+    assert resp.status_code == 400
+    resp = client.post('/api/auth/register', json={'username': ADMIN['username'], 'password': 'pw',
+                                                   'confirm_password': 'pw'})
+    assert resp.status_code == 400
+
+
+def test_login_rejects_bad_credentials(client):
+    assert login(client, ADMIN['username'], 'wrong').status_code == 401
+    assert login(client, 'nobody', 'pw').status_code == 401
+    assert client.post('/api/auth/login', json={'username': 'admin'}).status_code == 400
+
+
+def test_login_rate_limit_counts_only_failures(client, monkeypatch):
+    monkeypatch.setitem(music.app.config, 'LOGIN_RATE_LIMIT_CAPACITY', 3)
+    for _ in range(5):
+        assert login(client, **ADMIN).status_code == 200
+    for _ in range(3):
+        assert login(client, ADMIN['username'], 'wrong').status_code == 401
+    resp = login(client, ADMIN['username'], 'wrong')
+    assert resp.status_code == 429
+    assert 'Retry-After' in resp.headers
+    # 按 (用户名, IP) 计数：其他 IP 不受影响
+    other = music.app.test_client()
+    resp = other.post('/api/auth/login', json=ADMIN, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert resp.status_code == 200
+
+
+def test_login_required_routes(client):
+    assert client.get('/api/favorites').status_code == 401
+    assert client.post('/api/comments', json={'song_id': 1, 'content': 'hi'}).status_code == 401
+    assert client.get('/api/admin/songs').status_code == 401
+
+
+def test_admin_routes_reject_users(user):
+    assert user.get('/api/admin/songs').status_code == 403
+    assert user.get('/api/admin/cache').status_code == 403
+
+
+def test_admin_changes_role(admin, user):
+    resp = admin.put(f'/api/admin/users/{user.user_id}', json={'role': 'admin'})
+    assert resp.status_code == 200
+    assert user.get('/api/auth/me').json['data']['role'] == 'admin'
+    assert user.get('/api/admin/songs').status_code == 200
+
+    assert admin.put(f'/api/admin/users/{user.user_id}', json={'role': 'root'}).status_code == 400
+    assert admin.put('/api/admin/users/999', json={'role': 'user'}).status_code == 404
+
+
+def test_admin_deletes_user(admin, user, create_song):
+    song_id = create_song()
+    user.post(f'/api/favorites/{song_id}')
+    user.post('/api/comments', json={'song_id': song_id, 'content': 'hi'})
+
+    assert admin.delete(f'/api/admin/users/{user.user_id}').status_code == 200
+    assert user.get('/api/auth/me').status_code == 401
+    song = admin.get(f'/api/songs/{song_id}').json['data']['song']
+    assert (song['favorite_count'], song['comment_count']) == (0, 0)
+
+
+def test_logout_in_another_process_drops_cached_session(user, monkeypatch):
+    monkeypatch.setitem(music.app.config, 'AUTH_REVOCATION_POLL_INTERVAL', 0)
+    assert user.get('/api/auth/me').status_code == 200
+    # 其他进程处理的退出登录：删除会话行并写入失效记录，本进程的会话缓存中仍有该会话
+    music.DB.execute("DELETE FROM sessions WHERE user_id = ?", (user.user_id,), commit=True)
+    assert user.get('/api/auth/me').status_code == 200
+    music.record_revocation(user.user_id)
+    assert user.get('/api/auth/me').status_code == 401
+
+
+def test_logout_records_revocation(user):
+    user.post('/api/auth/logout')
+    rows = music.DB.execute("SELECT user_id FROM auth_revocations")
+    assert [row['user_id'] for row in rows] == [user.user_id]
+
+
+def test_revocations_polled_at_most_once_per_interval(user, monkeypatch):
+    user.get('/api/auth/me')
+    statements = []
+    monkeypatch.setattr(music.metrics, 'observe_query', lambda statement, *args: statements.append(statement))
+    for _ in range(3):
+        user.get('/api/auth/me')
+    assert not [s for s in statements if 'auth_revocations' in s]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import app as music
+
+from conftest import login
+
+
+def test_favorite_toggle(user, create_song):
+    song_id = create_song()
+    resp = user.post(f'/api/favorites/{song_id}')
+    assert resp.json['data'] == {'isFavorite': True}
+    # 重复收藏不重复计数
+    user.post(f'/api/favorites/{song_id}')
+
+    song = user.get(f'/api/songs/{song_id}').json['data']['song']
+    assert (song['favorite_count'], song['is_favorite']) == (1, True)
+    assert [s['id'] for s in user.get('/api/favorites').json['data']] == [song_id]
+
+    user.delete(f'/api/favorites/{song_id}')
+    song = user.get(f'/api/songs/{song_id}').json['data']['song']
+    assert (song['favorite_count'], song['is_favorite']) == (0, False)
+    assert user.get('/api/favorites').json['data'] == []
+    assert user.post('/api/favorites/999').status_code == 404
+
+
+def test_favorites_change_personal_etag(user, create_song):
+    song_id = create_song()
+    etag = user.get('/api/songs').headers['ETag']
+    user.post(f'/api/favorites/{song_id}')
+    resp = user.get('/api/songs', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.json['data']['songs'][0]['is_favorite'] is True
+
+
+def test_batch_favorites(user, create_song):
+    first, second = create_song(), create_song()
+    user.post(f'/api/favorites/{second}')
+    resp = user.post('/api/favorites/batch', json={'add': [first, 999], 'remove': [second]})
+    assert resp.json['data'] == {'added': [first], 'removed': [second], 'missing': [999]}
+    assert [s['id'] for s in user.get('/api/favorites').json['data']] == [first]
+
+    assert user.post('/api/favorites/batch', json={'add': ['1']}).status_code == 400
+    assert user.post('/api/favorites/batch', json={}).status_code == 400
+
+
+def test_comments(user, create_song):
+    song_id = create_song()
+    resp = user.post('/api/comments', json={'song_id': song_id, 'content': 'first'})
+    assert resp.status_code == 201
+    assert resp.json['data']['username'] == 'alice'
+    user.post('/api/comments', json={'song_id': song_id, 'content': 'second'})
+    assert user.post('/api/comments', json={'song_id': song_id}).status_code == 400
+
+    page = user.get(f'/api/songs/{song_id}/comments?limit=1').json['data']
+    assert page['comment_count'] == 2
+    assert [c['content'] for c in page['comments']] == ['second']
+    rest = user.get(f"/api/songs/{song_id}/comments?limit=1&cursor={page['next_cursor']}").json['data']
+    assert [c['content'] for c in rest['comments']] == ['first']
+    assert user.get('/api/songs/999/comments').status_code == 404
+
+
+def test_delete_comment(admin, user, create_song):
+    song_id = create_song()
+    comment_id = user.post('/api/comments', json={'song_id': song_id, 'content': 'hi'}).json['data']['id']
+
+    other = music.app.test_client()
+    other.post('/api/auth/register', json={'username': 'carol', 'password': 'pw', 'confirm_password': 'pw'})
+    assert other.delete(f'/api/comments/{comment_id}').status_code == 403
+
+    assert user.delete(f'/api/comments/{comment_id}').status_code == 200
+    assert admin.delete(f'/api/comments/{comment_id}').status_code == 404
+    assert user.get(f'/api/songs/{song_id}').json['data']['song']['comment_count'] == 0
+
+
+def test_write_behind(user, create_song, monkeypatch):
+    song_id = create_song()
+    monkeypatch.setitem(music.app.config, 'WRITE_BEHIND', True)
+    assert user.post(f'/api/favorites/{song_id}').json['data'] == {'isFavorite': True}
+    assert user.post('/api/comments', json={'song_id': song_id, 'content': 'hi'}).status_code == 201
+
+    monkeypatch.setitem(music.app.config, 'WRITE_BEHIND_DURABILITY', 'queued')
+    resp = user.post('/api/comments', json={'song_id': song_id, 'content': 'later'})
+    assert (resp.status_code, resp.json['data']) == (202, {'queued': True})
+    music.write_queue().close()
+    music._write_queue = None
+    assert user.get(f'/api/songs/{song_id}/comments').json['data']['comment_count'] == 2
+
+
+def test_session_survives_relogin_elsewhere(user):
+    other = music.app.test_client()
+    assert login(other, 'alice', 'pw').status_code == 200
+    assert user.get('/api/auth/me').status_code == 200
+    assert other.get('/api/auth/me').status_code == 200
+
+
+def test_favorite_versions_stay_out_of_response_cache(user, create_song):
+    create_song()
+    user.get('/api/songs')
+    stats = music.get_cache().stats()
+    for _ in range(3):
+        user.get('/api/songs')
+    after = music.get_cache().stats()
+    assert (after['hits'] - stats['hits'], after['misses'] - stats['misses']) == (3, 0)
+    assert after['entries'] == stats['entries']
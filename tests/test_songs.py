@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import app as music
+
+from conftest import SONG
+
+
+def test_list_songs_paginates_newest_first(client, create_song):
+    ids = [create_song(title=f'Song {i}') for i in range(3)]
+    resp = client.get('/api/songs?limit=2')
+    assert resp.status_code == 200
+    page = resp.json['data']
+    assert [s['id'] for s in page['songs']] == ids[:0:-1]
+    assert 'lyrics' not in page['songs'][0]
+
+    rest = client.get(f"/api/songs?limit=2&cursor={page['next_cursor']}").json['data']
+    assert [s['id'] for s in rest['songs']] == [ids[0]]
+    assert rest['next_cursor'] is None
+
+
+def test_list_songs_filters(client, create_song):
+    rock = create_song(genre='rock', artist='Band')
+    create_song(genre='pop')
+    assert [s['id'] for s in client.get('/api/songs?genre=rock').json['data']['songs']] == [rock]
+    assert [s['id'] for s in client.get('/api/songs?artist=Band').json['data']['songs']] == [rock]
+
+    songs = client.get('/api/songs?fields=title').json['data']['songs']
+    assert set(songs[0]) == {'id', 'created_at', 'title', 'is_favorite'}
+
+
+def test_list_songs_sorts_by_duration(client, create_song):
+    short, long = create_song(), create_song()
+    music.DB.execute("UPDATE music SET duration_seconds = ? WHERE id = ?", (120, short), commit=True)
+    music.DB.execute("UPDATE music SET duration_seconds = ? WHERE id = ?", (300, long), commit=True)
+    music.get_cache().clear()
+    assert [s['id'] for s in client.get('/api/songs?sort=-duration').json['data']['songs']] == [long, short]
+    resp = client.get('/api/songs?sort=duration&min_duration=200')
+    assert [s['id'] for s in resp.json['data']['songs']] == [long]
+
+
+def test_list_songs_rejects_bad_arguments(client):
+    assert client.get('/api/songs?sort=title').status_code == 400
+    assert client.get('/api/songs?fields=password').status_code == 400
+    assert client.get('/api/songs?cursor=garbage').status_code == 400
+    assert client.get('/api/songs?limit=0').status_code == 400
+    assert client.get('/api/songs?min_duration=abc').status_code == 400
+
+
+def test_list_songs_etag(client, admin, create_song):
+    create_song()
+    resp = client.get('/api/songs')
+    etag = resp.headers['ETag']
+    assert client.get('/api/songs', headers={'If-None-Match': etag}).status_code == 304
+
+    create_song(title='Another')
+    assert client.get('/api/songs', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_song_detail(client, create_song):
+    song_id = create_song()
+    related = create_song(title='Related')
+    resp = client.get(f'/api/songs/{song_id}')
+    assert resp.status_code == 200
+    data = resp.json['data']
+    assert data['song']['title'] == 'Test Song'
+    assert data['song']['lyrics'] == 'la la la'
+    assert related in [s['id'] for s in data['related_songs']]
+    assert client.get('/api/songs/999').status_code == 404
+
+
+def test_search(client, create_song):
+    song_id = create_song(title='Midnight Train', artist='Someone')
+    create_song(title='Morning Walk')
+    resp = client.get('/api/search?q=midnight')
+    assert resp.status_code == 200
+    assert [s['id'] for s in resp.json['data']['songs']] == [song_id]
+    assert client.get('/api/search?q=').status_code == 400
+
+
+def test_stream_song(client):
+    song_id = music.DB.execute(
+        "INSERT INTO music (title, artist, audio_path) VALUES ('Stream', 'Tester', 'song11.mp3') RETURNING id",
+        commit=True)
+    resp = client.get(f'/api/songs/{song_id}/stream')
+    assert resp.status_code == 200
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert 'immutable' not in resp.headers['Cache-Control']
+    resp.close()
+
+    resp = client.get(f'/api/songs/{song_id}/stream', headers={'Range': 'bytes=0-9'})
+    assert resp.status_code == 206
+    assert len(resp.data) == 10
+    resp.close()
+
+    missing = music.DB.execute(
+        "INSERT INTO music (title, artist, audio_path) VALUES ('Gone', 'Tester', 'missing.mp3') RETURNING id",
+        commit=True)
+    assert client.get(f'/api/songs/{missing}/stream').status_code == 404
+    assert client.get('/api/songs/999/stream').status_code == 404
+
+
+def test_categories(client, admin, create_song):
+    song_id = create_song()
+    create_song(title='Other')
+    category_id = admin.post('/api/admin/categories', json={'name': 'Chill'}).json['data']['id']
+    admin.post('/api/admin/categories', json={'name': 'live', 'type': 'tag'})
+
+    resp = admin.post(f'/api/admin/categories/{category_id}/songs', json={'song_ids': [song_id, 999]})
+    assert resp.json['data'] == {'changed': 1, 'missing': [999]}
+
+    categories = client.get('/api/categories?type=category').json['data']
+    assert [(c['name'], c['song_count']) for c in categories] == [('Chill', 1)]
+    assert client.get('/api/categories?type=genre').status_code == 400
+    assert [s['id'] for s in client.get('/api/songs?category=Chill').json['data']['songs']] == [song_id]
+    assert client.get(f'/api/songs/{song_id}').json['data']['song']['categories'] == ['Chill']
+
+
+def test_favorites_chart(client, user, create_song):
+    create_song()
+    second = create_song()
+    user.post(f'/api/favorites/{second}')
+    for window in ('all', 'day', 'week'):
+        resp = client.get(f'/api/charts/favorites?window={window}')
+        assert resp.status_code == 200
+        assert [s['id'] for s in resp.json['data']['songs']] == [second]
+    assert client.get('/api/charts/favorites?window=year').status_code == 400
+
+
+def test_song_detail_etag_follows_related_songs(client, admin, create_song, monkeypatch):
+    monkeypatch.setitem(music.app.config, 'RELATED_SONGS_SHOWN', 1)
+    song_id, related = create_song(), create_song(title='Related')
+    music.DB.execute("INSERT INTO related_songs (song_id, related_id, score) VALUES (?, ?, 1)", (song_id, related),
+                     commit=True)
+    resp = client.get(f'/api/songs/{song_id}')
+    etag = resp.headers['ETag']
+    assert client.get(f'/api/songs/{song_id}', headers={'If-None-Match': etag}).status_code == 304
+
+    admin.put(f'/api/admin/songs/{related}', json=dict(SONG, title='Renamed'))
+    resp = client.get(f'/api/songs/{song_id}', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.json['data']['related_songs'][0]['title'] == 'Renamed'
+
+    etag = resp.headers['ETag']
+    admin.delete(f'/api/admin/songs/{related}')
+    resp = client.get(f'/api/songs/{song_id}', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.json['data']['related_songs'] == []
+
+
+def test_replica_sync_clears_stale_cache_in_every_process(backend, client, user, create_song, tmp_path, monkeypatch):
+    if backend != 'sqlite':
+        pytest.skip('PostgreSQL 副本由流复制维护')
+    monkeypatch.setitem(music.app.config, 'DB_REPLICAS', [str(tmp_path / 'replica.db')])
+    monkeypatch.setitem(music.app.config, 'REPLICA_VERSION_POLL_INTERVAL', 0)
+    monkeypatch.setattr(music, '_replica_version_checked_at', 0)
+    syncer = music.ReplicaSync(None)
+    song_id = create_song()
+    syncer.sync()
+    assert [s['id'] for s in client.get('/api/songs').json['data']['songs']] == [song_id]
+
+    # 同步之前缓存了旧副本上的列表；同步线程不在本进程中，由请求检查 synced_version 后清空缓存
+    other = create_song(title='Other')
+    assert [s['id'] for s in client.get('/api/songs').json['data']['songs']] == [song_id]
+    syncer.sync()
+    assert [s['id'] for s in client.get('/api/songs').json['data']['songs']] == [other, song_id]
+
+    # 收藏不改变曲库版本，同步后不清空缓存
+    user.post(f'/api/favorites/{song_id}')
+    client.get('/api/songs')
+    hits = music.get_cache().stats()['hits']
+    syncer.sync()
+    client.get('/api/songs')
+    assert music.get_cache().stats()['hits'] == hits + 1